@@ -0,0 +1,18 @@
+import pytest
+
+import db_pool
+from setup_db import migrate
+
+
+@pytest.fixture
+def ledger_db(tmp_path, monkeypatch):
+    """Fresh, fully migrated business_ledger.db in a temp directory.
+
+    DB_FILE is relative, so pooled connections (and the writer thread's) open
+    it in the current directory; idle ones from an earlier test are closed.
+    """
+    db_pool.pool.close_all()
+    monkeypatch.chdir(tmp_path)
+    migrate()
+    yield tmp_path / db_pool.DB_FILE
+    db_pool.pool.close_all()
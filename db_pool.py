@@ -0,0 +1,82 @@
+import queue
+import sqlite3
+from contextlib import contextmanager
+
+DB_FILE = 'business_ledger.db'
+
+# हर नए connection पर एक बार लगते हैं
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",          # readers writer को block नहीं करते
+    "PRAGMA synchronous=NORMAL",        # WAL में safe, हर commit पर fsync नहीं
+    "PRAGMA cache_size=-16000",         # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",       # 256 MB memory-mapped reads
+    "PRAGMA busy_timeout=5000",         # lock मिलने तक 5 sec रुको, तुरंत error नहीं
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class ConnectionPool:
+    """
+    Small per-process pool of configured SQLite connections.
+
+    Streamlit runs every session (and every rerun) on its own thread, so the
+    connections are opened with check_same_thread=False and handed out one
+    borrower at a time.
+    """
+
+    def __init__(self, db_file, size=8):
+        self.db_file = db_file
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        try:
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+        except BaseException:
+            # PRAGMA fail हुआ (जैसे file locked) तो आधी-खुली connection बंद करें
+            conn.close()
+            raise
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection: commits on success, rolls back on error, then returns it to the pool"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self):
+        """Close every idle connection (before the database file is touched directly)"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+pool = ConnectionPool(DB_FILE)
+
+
+def connection():
+    """Shortcut for `with connection() as conn:` on the shared pool"""
+    return pool.connection()
+
+
+def checkpoint():
+    """WAL में पड़ा सारा data main DB file में लिख दो (file को सीधे पढ़ने/बदलने से पहले)"""
+    with connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
@@ -0,0 +1,572 @@
+import datetime
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from db_pool import DB_FILE, connection
+from setup_db import migrate
+from write_queue import writer
+
+# --- HOT BACKUP (SQLite backup API) ---
+BACKUP_DIR = "backups"
+MANIFEST_FILE = os.path.join(BACKUP_DIR, "manifest.json")
+
+# इतने snapshots disk पर रहते हैं, पुराने अपने-आप हटते हैं
+BACKUP_KEEP = 7
+
+# हर step में इतने pages copy करो, फिर lock छोड़ दो ताकि writers रुके नहीं
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+
+# lzma preset 0: gzip से ~1/3 छोटी file; preset 6 उतना ही और छोटा करता है पर ~7x धीमा है
+COMPRESSORS = {
+    "gzip": (".db.gz", lambda path: gzip.open(path, "wb", compresslevel=6)),
+    "lzma": (".db.xz", lambda path: lzma.open(path, "wb", preset=0)),
+}
+COPY_CHUNK = 1024 * 1024
+
+# Incremental backup: `changes` journal (setup_db.init_db) के बाद की rows, इसी क्रम में apply होती हैं
+# (accounts पहले ताकि नई transaction के party नाम FTS trigger को मिल जाएँ)
+JOURNALED_TABLES = ("accounts", "transactions", "opening_balances")
+CURRENT_SEQ_SQL = "SELECT COALESCE(MAX(seq), 0) FROM changes"
+DELTA_SUFFIX = ".delta.gz"
+DELTA_PREFIX = b'{"kind": "delta"'
+ID_CHUNK = 500
+
+# एक समय में एक ही backup या restore (दो sessions एक साथ बटन दबाएँ तो दूसरा इंतज़ार करे)
+_backup_lock = threading.Lock()
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest():
+    """Snapshot entries, newest first ([] when there is no backup yet)"""
+    try:
+        with open(MANIFEST_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def _write_manifest(entries):
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp, MANIFEST_FILE)
+
+
+def create_backup(compression="gzip"):
+    """
+    Take a consistent snapshot of the live database and store it compressed
+    in BACKUP_DIR. Returns the new manifest entry.
+
+    sqlite3's backup API copies PAGES_PER_STEP pages at a time. The source
+    connection holds one read transaction for the whole copy, which in WAL
+    mode pins a single committed state without blocking writers, so writes
+    made meanwhile neither stall nor restart the copy. The snapshot is then
+    compressed, checksummed (sha256 of the stored file) and recorded in
+    manifest.json with its `changes` journal position (seq), which is where
+    the next incremental backup starts.
+    """
+    suffix, open_compressed = COMPRESSORS[compression]
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+
+    with _backup_lock:
+        created = datetime.datetime.now()
+        name = f"ledger_{created:%Y%m%d_%H%M%S}{suffix}"
+        raw_path = os.path.join(BACKUP_DIR, name + ".part.db")
+        path = os.path.join(BACKUP_DIR, name)
+
+        try:
+            target = sqlite3.connect(raw_path)
+            try:
+                with connection() as conn:
+                    # खुला read transaction = WAL का एक fixed snapshot; हर step उसी से पढ़ता है,
+                    # इसलिए बीच में हुई writes से copy दोबारा शुरू नहीं होती (और writers रुकते नहीं)
+                    conn.execute("BEGIN")
+                    seq = conn.execute(CURRENT_SEQ_SQL).fetchone()[0]
+                    conn.backup(target, pages=PAGES_PER_STEP, sleep=STEP_SLEEP)
+                # Snapshot अपने आप में पूरी file हो (WAL के बिना)
+                target.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                target.close()
+
+            with open(raw_path, "rb") as src, open_compressed(path + ".tmp") as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+            os.replace(path + ".tmp", path)
+
+            entry = {
+                "file": name,
+                "kind": "full",
+                "created": created.isoformat(timespec="seconds"),
+                "seq": seq,
+                "compression": compression,
+                "db_bytes": os.path.getsize(raw_path),
+                "bytes": os.path.getsize(path),
+                "sha256": _sha256(path),
+            }
+        finally:
+            for leftover in (raw_path, path + ".tmp"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        _record(entry)
+        return entry
+
+
+def _record(entry):
+    """
+    Add `entry` to the manifest and apply the retention policy: the newest
+    BACKUP_KEEP full snapshots are kept, with every delta taken after the
+    oldest of them; anything older is deleted from disk.
+    """
+    entries = [entry] + [e for e in read_manifest() if e["file"] != entry["file"]]
+    fulls = 0
+    for keep, e in enumerate(entries, start=1):
+        if e.get("kind", "full") == "full":
+            fulls += 1
+            if fulls == BACKUP_KEEP:
+                break
+    for old in entries[keep:]:
+        old_path = os.path.join(BACKUP_DIR, old["file"])
+        if os.path.exists(old_path):
+            os.remove(old_path)
+    _write_manifest(entries[:keep])
+
+
+def _columns(conn, table):
+    """Stored columns of `table` (generated columns like transactions.day are left out)"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def create_incremental_backup():
+    """
+    Store only what changed since the newest backup in the manifest, as a
+    gzip'd JSON-lines delta. Returns the new manifest entry, or None when
+    nothing changed.
+
+    The `changes` journal lists every (table, row id) written since that
+    backup's seq. The delta holds the current image of each such row (or a
+    delete marker), followed by the journal entries themselves so a replayed
+    database ends up at exactly the same seq. Everything is read in one read
+    transaction, so rows and journal agree. Raises ValueError when there is
+    no full snapshot to build on, or the database was replaced since.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+
+    with _backup_lock:
+        entries = read_manifest()
+        if not entries or "seq" not in entries[0]:
+            raise ValueError("पहले एक full snapshot लें - incremental उसके बाद के बदलाव ही रखता है।")
+        since = entries[0]["seq"]
+        created = datetime.datetime.now()
+        path = None
+
+        try:
+            with connection() as conn:
+                conn.execute("BEGIN")
+                seq = conn.execute(CURRENT_SEQ_SQL).fetchone()[0]
+                if seq < since:
+                    raise ValueError("Database पिछले backup के बाद बदली गई है (restore/reset) - नया full snapshot लें।")
+                if seq == since:
+                    return None
+                # seq range नाम में: एक ही second में बनी दो deltas भी अलग files रहें
+                name = f"ledger_{created:%Y%m%d_%H%M%S}_{since}-{seq}{DELTA_SUFFIX}"
+                path = os.path.join(BACKUP_DIR, name)
+
+                journal = conn.execute(
+                    "SELECT seq, table_name, row_id, op FROM changes WHERE seq > ? AND seq <= ? ORDER BY seq",
+                    (since, seq)
+                ).fetchall()
+                columns = {table: _columns(conn, table) for table in JOURNALED_TABLES}
+                header = {"kind": "delta", "from_seq": since, "to_seq": seq,
+                          "created": created.isoformat(timespec="seconds"), "columns": columns}
+
+                rows = 0
+                with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=9) as f:
+                    f.write(json.dumps(header) + "\n")
+                    deleted = []
+                    for table in JOURNALED_TABLES:
+                        ids = sorted({row_id for _, t, row_id, _ in journal if t == table})
+                        found = set()
+                        for start in range(0, len(ids), ID_CHUNK):
+                            chunk = ids[start:start + ID_CHUNK]
+                            marks = ",".join("?" * len(chunk))
+                            for row in conn.execute(
+                                f"SELECT {', '.join(columns[table])} FROM {table} WHERE id IN ({marks})", chunk
+                            ):
+                                f.write(json.dumps(["R", table, row]) + "\n")
+                                found.add(row[0])
+                        deleted += [(table, row_id) for row_id in ids if row_id not in found]
+                        rows += len(ids)
+                    # Deletes आखिर में, उल्टे क्रम में (पहले transactions, फिर accounts)
+                    for table, row_id in reversed(deleted):
+                        f.write(json.dumps(["D", table, row_id]) + "\n")
+                    for change in journal:
+                        f.write(json.dumps(["J", *change]) + "\n")
+            os.replace(path + ".tmp", path)
+        finally:
+            if path and os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+
+        entry = {
+            "file": name,
+            "kind": "delta",
+            "created": created.isoformat(timespec="seconds"),
+            "from_seq": since,
+            "seq": seq,
+            "rows": rows,
+            "bytes": os.path.getsize(path),
+            "sha256": _sha256(path),
+        }
+        _record(entry)
+        return entry
+
+
+def backup_path(entry):
+    return os.path.join(BACKUP_DIR, entry["file"])
+
+
+def latest_full_backup():
+    """Newest full snapshot whose file is still on disk, or None"""
+    for entry in read_manifest():
+        if entry.get("kind", "full") == "full" and os.path.exists(backup_path(entry)):
+            return entry
+    return None
+
+
+def deltas_after(full):
+    """
+    The incremental backups that replay on top of the snapshot `full`,
+    oldest first - the files a restore needs after it, in order. The chain
+    stops at the first gap (a delta file missing from disk).
+    """
+    entries = read_manifest()
+    newer = entries[:entries.index(full)] if full in entries else []
+    chain, seq = [], full.get("seq")
+    for entry in reversed(newer):
+        if entry.get("kind") != "delta" or entry["from_seq"] != seq:
+            continue
+        if not os.path.exists(backup_path(entry)):
+            break
+        chain.append(entry)
+        seq = entry["seq"]
+    return chain
+
+
+# Journal की पुरानी rows: newest row हमेशा रहती है, ताकि MAX(seq) (सबकी journal position) न हिले
+PRUNE_CHANGES_SQL = "DELETE FROM changes WHERE seq < ? AND seq < (SELECT MAX(seq) FROM changes)"
+
+
+def prune_changes(keep_from):
+    """
+    Queue a write that deletes the `changes` rows below seq `keep_from`
+    (the oldest position a reader still needs, e.g. the caches' last seq).
+
+    Rows after the newest full snapshot are kept as well, since the
+    incremental backups built on it replay from there. Returns the write's
+    Future (number of rows deleted); callers need not wait for it.
+    """
+    full = latest_full_backup()
+    if full is not None:
+        keep_from = min(keep_from, full["seq"])
+    return writer.submit(lambda conn: conn.execute(PRUNE_CHANGES_SQL, (keep_from,)).rowcount)
+
+
+def read_backup(entry):
+    """Bytes of a stored snapshot (download callback)"""
+    with open(backup_path(entry), "rb") as f:
+        return f.read()
+
+
+def verify_backup(entry):
+    """True when the stored file still matches the checksum in the manifest"""
+    return _sha256(backup_path(entry)) == entry["sha256"]
+
+
+# --- VALIDATED RESTORE ---
+# Upload इनमें से किसी रूप में हो सकता है: plain .db या हमारे ही .db.gz / .db.xz snapshots
+SQLITE_MAGIC = b"SQLite format 3\x00"
+DECOMPRESSORS = (
+    (b"\x1f\x8b", gzip.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+)
+
+# Restore के लायक file में कम से कम ये tables / columns होने चाहिए.
+# पुराने backups (from_acc/to_acc नाम वाले) भी चलते हैं - prepare_restore उन्हें live DB में जाने से पहले migrate करता है
+REQUIRED_COLUMNS = {
+    "accounts": {"id", "name"},
+    "transactions": {"id", "date", "amount", "note"},
+    "opening_balances": {"balance", "type", "financial_year"},
+}
+PARTY_COLUMNS = ({"from_id", "to_id"}, {"from_acc", "to_acc"})
+COUNTED_TABLES = ("accounts", "transactions", "opening_balances")
+
+
+def spool_upload(upload):
+    """
+    Copy an uploaded backup (file-like) into a temp file next to DB_FILE,
+    decompressing gzip / xz snapshots on the way. Returns the temp path;
+    the caller removes it (restore_database moves it into place).
+
+    Same directory as DB_FILE so the later os.replace is a rename on one
+    filesystem, never a half-finished copy.
+    """
+    upload.seek(0)
+    head = upload.read(8)
+    upload.seek(0)
+    source = upload
+    for magic, opener in DECOMPRESSORS:
+        if head.startswith(magic):
+            source = opener(upload, "rb")
+
+    fd, path = tempfile.mkstemp(prefix=".restore_", suffix=".db", dir=os.path.dirname(os.path.abspath(DB_FILE)))
+    try:
+        with os.fdopen(fd, "wb") as dst:
+            shutil.copyfileobj(source, dst, COPY_CHUNK)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    try:
+        _rollback_journal(path)
+    except sqlite3.DatabaseError:
+        pass  # inspect_backup बताएगा कि file में क्या गड़बड़ है
+    return path
+
+
+def _rollback_journal(path):
+    # Live file की raw copy (या migrated copy) WAL mode में होती है; उसे read-only खोलने पर -wal/-shm files बच जाती हैं
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+
+
+def _is_delta(upload):
+    upload.seek(0)
+    try:
+        with gzip.open(upload, "rb") as f:
+            return f.read(len(DELTA_PREFIX)) == DELTA_PREFIX
+    except (OSError, EOFError):
+        return False
+    finally:
+        upload.seek(0)
+
+
+def _delta_header(upload):
+    upload.seek(0)
+    with gzip.open(upload, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+    upload.seek(0)
+    return header
+
+
+def _apply_row(conn, table, names, row):
+    """Insert the row image, or update just the columns that differ"""
+    existing = conn.execute(f"SELECT {', '.join(names)} FROM {table} WHERE id = ?", (row[0],)).fetchone()
+    if existing is None:
+        conn.execute(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({','.join('?' * len(row))})", row)
+    elif existing != row:
+        changed = [(col, new) for col, old, new in zip(names, existing, row) if old != new]
+        conn.execute(
+            f"UPDATE {table} SET {', '.join(f'{col} = ?' for col, _ in changed)} WHERE id = ?",
+            [new for _, new in changed] + [row[0]]
+        )
+
+
+def apply_delta(path, upload):
+    """
+    Replay one incremental backup onto the database file at `path`, in a
+    single transaction. The database must be exactly at the delta's from_seq
+    (its base snapshot, or the previous delta applied) - ValueError otherwise.
+
+    Rows go through normal INSERT / UPDATE / DELETE so the triggers keep
+    balances, daily totals and search in step; the journal rows those
+    triggers write are then swapped for the delta's own, leaving `changes`
+    identical to the source database.
+    """
+    header = _delta_header(upload)
+    conn = sqlite3.connect(path)
+    try:
+        current = conn.execute(CURRENT_SEQ_SQL).fetchone()[0]
+        if current != header["from_seq"]:
+            raise ValueError(
+                f"Delta (seq {header['from_seq']} → {header['to_seq']}) इस database (seq {current}) के ठीक बाद का नहीं है।"
+            )
+
+        # Base snapshot किसी पुराने schema का हो (जैसे version column से पहले का) तो delta के
+        # नए columns छोड़ दो - prepare_restore की migrations उन्हें default से भर देंगी
+        keep = {}
+        for table, names in header["columns"].items():
+            stored = set(_columns(conn, table))
+            keep[table] = [i for i, name in enumerate(names) if name in stored]
+        names = {table: [header["columns"][table][i] for i in idx] for table, idx in keep.items()}
+
+        journal = []
+        with conn, gzip.open(upload, "rt", encoding="utf-8") as f:
+            f.readline()
+            for line in f:
+                record = json.loads(line)
+                if record[0] == "R":
+                    _, table, row = record
+                    _apply_row(conn, table, names[table], tuple(row[i] for i in keep[table]))
+                elif record[0] == "D":
+                    _, table, row_id = record
+                    conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+                else:
+                    journal.append(record[1:])
+
+            conn.execute("DELETE FROM changes WHERE seq > ?", (header["from_seq"],))
+            conn.executemany("INSERT INTO changes (seq, table_name, row_id, op) VALUES (?, ?, ?, ?)", journal)
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'changes'", (header["to_seq"],))
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Delta apply नहीं हो सका: {e}") from e
+    finally:
+        conn.close()
+
+
+def spool_uploads(uploads):
+    """
+    Temp database built from uploaded backups: exactly one full snapshot plus
+    any number of incremental deltas, which are replayed on it in seq order.
+    Returns the temp path (see spool_upload); raises ValueError if the files
+    do not form one unbroken chain.
+    """
+    bases, deltas = [], []
+    for upload in uploads:
+        (deltas if _is_delta(upload) else bases).append(upload)
+    if len(bases) != 1:
+        raise ValueError("एक full backup (.db / .db.gz / .db.xz) और उसके बाद की delta files चुनें।")
+
+    path = spool_upload(bases[0])
+    try:
+        for upload in sorted(deltas, key=lambda d: _delta_header(d)["from_seq"]):
+            apply_delta(path, upload)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def row_counts(conn):
+    return {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in COUNTED_TABLES
+    }
+
+
+def inspect_backup(path):
+    """
+    Check that `path` is an intact ledger database and return its row counts.
+
+    Raises ValueError (with a message for the user) when the file is not
+    SQLite, fails PRAGMA integrity_check, or lacks the ledger tables.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(SQLITE_MAGIC)) != SQLITE_MAGIC:
+            raise ValueError("यह SQLite database file नहीं है।")
+
+    # Read-only: जाँच के दौरान file में कुछ न लिखा जाए
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check(20)")]
+        if problems != ["ok"]:
+            raise ValueError("Integrity check failed: " + "; ".join(problems[:5]))
+
+        for table, needed in REQUIRED_COLUMNS.items():
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if not columns:
+                raise ValueError(f"Table '{table}' नहीं मिली - यह ledger backup नहीं लगता।")
+            if table == "transactions" and not any(pair <= columns for pair in PARTY_COLUMNS):
+                needed = needed | PARTY_COLUMNS[0]
+            missing = needed - columns
+            if missing:
+                raise ValueError(f"Table '{table}' में columns नहीं हैं: {', '.join(sorted(missing))}")
+
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        with connection() as live:
+            live_page_size = live.execute("PRAGMA page_size").fetchone()[0]
+        if page_size != live_page_size:
+            # WAL database में backup API अलग page size की copy नहीं लिख सकता
+            raise ValueError(f"Backup का page size ({page_size}) इस database ({live_page_size}) से अलग है।")
+
+        return row_counts(conn)
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"File पढ़ी नहीं जा सकी: {e}") from e
+    finally:
+        conn.close()
+
+
+def restore_preview(path):
+    """Rows per table: current database vs the backup at `path` (validates it first)"""
+    incoming = inspect_backup(path)
+    with connection() as conn:
+        current = row_counts(conn)
+    return [
+        {"Table": table, "Current": current[table], "Backup": incoming[table],
+         "Change": incoming[table] - current[table]}
+        for table in COUNTED_TABLES
+    ]
+
+
+def prepare_restore(path, progress=None):
+    """
+    Get the spooled copy at `path` ready to replace the live database and
+    return its restore_preview rows.
+
+    The file is validated, migrated in place to the current schema and
+    validated again, all before the live database is touched - so a restore
+    never serves an old schema, and a failed migration leaves only the temp
+    copy half-upgraded. Raises ValueError with a message for the user.
+    progress is handed to setup_db.migrate.
+    """
+    inspect_backup(path)
+    try:
+        migrate(progress, db_file=path)
+        _rollback_journal(path)
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Backup का schema upgrade नहीं हो सका: {e}") from e
+    return restore_preview(path)
+
+
+def restore_database(path):
+    """
+    Replace the live database with the file at `path`, atomically. `path`
+    must already have gone through prepare_restore (validated and migrated).
+
+    The pages are copied by SQLite's backup API in a single step, which is one
+    write transaction on the live database: it waits for SQLite's write lock,
+    and readers see either the old ledger or the new one, never a mix. A crash
+    mid-copy leaves an uncommitted WAL tail that SQLite discards, so the old
+    file stays intact. (Renaming over the file with os.replace is not safe in
+    WAL mode: a connection still open on the old file deletes the -wal file
+    by name when it closes, which by then belongs to the restored database.)
+
+    The writer queue is paused for the copy, so no queued write lands on
+    either side of it. Pooled connections see the new data on their next
+    query; the caller must drop its own caches. The temp file at `path` is
+    removed.
+    """
+    with _backup_lock, writer.paused():
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            with connection() as conn:
+                source.backup(conn, pages=-1)
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            source.close()
+    os.remove(path)
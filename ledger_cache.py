@@ -0,0 +1,143 @@
+import threading
+import weakref
+
+import pandas as pd
+
+from db_pool import connection
+from money import rupees_frame
+from ledger_backup import prune_changes
+from ledger_engine import dates_from_days
+
+# इस process की सारी caches - journal उनमें से सबसे पीछे वाली की position तक ही छोटा होता है
+_caches = weakref.WeakSet()
+
+
+class LedgerCache:
+    """
+    One in-memory copy of the accounts and transactions tables, shared by
+    every Streamlit session in this process.
+
+    The `changes` journal (filled by triggers, see setup_db.init_db) tells us
+    what was written since the last refresh, so a rerun only reads new rows
+    (id > last_id) and re-reads rows that were updated or deleted.
+
+    Transactions store account ids; the from_acc / to_acc name columns are
+    added here as categoricals so a party rename only re-labels them.
+    Amounts are converted from stored paise to rupees and `date` becomes a
+    datetime64 column (from the integer day column) once, on read.
+
+    Every PRUNE_EVERY journal entries, the rows no cache in this process
+    still needs are pruned (ledger_backup.prune_changes), so the journal
+    does not grow forever.
+    """
+
+    # Text `date` नहीं पढ़ते: integer day से datetime64 बनाना parse से सस्ता है
+    COLUMNS = "id, day, from_id, to_id, amount, note, txn_type, status"
+
+    # इससे ज़्यादा बदली हुई rows हों तो पूरी table दोबारा पढ़ना सस्ता है
+    FULL_RELOAD_AT = 5000
+    CHUNK = 500
+    PRUNE_EVERY = 10000
+
+    def __init__(self):
+        self.seq = None
+        self.last_id = 0
+        self.acc_df = None
+        self.account_names = {}
+        self.trans_df = None
+        self._pruned_at = 0
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def snapshot(self):
+        """Return (acc_df, trans_df), reading only what changed since the last call.
+
+        The frames are shared between sessions: callers must copy before mutating.
+        """
+        with self._lock:
+            with connection() as conn:
+                # seq पहले पढ़ो: इसके बाद की कोई write अगली बार फिर से apply हो जाएगी
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+                if self.trans_df is None or seq < self.seq:
+                    # पहली बार, या DB बदल दी गई (restore/reset) - सब कुछ पढ़ो
+                    self._load_accounts(conn)
+                    self._load_transactions(conn)
+                elif seq > self.seq:
+                    self._apply_changes(conn, seq)
+
+                self.seq = seq
+
+            if seq - self._pruned_at >= self.PRUNE_EVERY:
+                # Writer thread पर, बिना इंतज़ार किए
+                self._pruned_at = seq
+                prune_changes(min(cache.seq for cache in list(_caches) if cache.seq is not None))
+            return self.acc_df, self.trans_df
+
+    def _load_accounts(self, conn):
+        self.acc_df = pd.read_sql_query("SELECT * FROM accounts", conn)
+        self.account_names = dict(zip(self.acc_df['id'], self.acc_df['name']))
+
+    def _with_names(self, df):
+        """id, date, from_acc, to_acc, ... - names resolved from the id columns"""
+        categories = sorted(self.account_names.values())
+        names = {
+            'from_acc': pd.Categorical(df['from_id'].map(self.account_names), categories=categories),
+            'to_acc': pd.Categorical(df['to_id'].map(self.account_names), categories=categories),
+        }
+        rest = df.drop(columns=['id', 'date', 'from_acc', 'to_acc'], errors='ignore')
+        return pd.concat([df[['id', 'date']], pd.DataFrame(names, index=df.index), rest], axis=1)
+
+    @staticmethod
+    def _read(conn, query, params=()):
+        """Transactions rows with rupee amounts and a datetime64 `date` in place of `day`"""
+        df = rupees_frame(pd.read_sql_query(query, conn, params=params))
+        df.insert(1, 'date', dates_from_days(df.pop('day')))
+        return df
+
+    def _load_transactions(self, conn):
+        self.trans_df = self._with_names(self._read(conn, f"SELECT {self.COLUMNS} FROM transactions ORDER BY id"))
+        self.last_id = int(self.trans_df['id'].max()) if not self.trans_df.empty else 0
+
+    def _apply_changes(self, conn, seq):
+        rows = conn.execute(
+            "SELECT table_name, row_id FROM changes WHERE seq > ? AND seq <= ?",
+            (self.seq, seq)
+        ).fetchall()
+
+        trans_ids = {row_id for table, row_id in rows if table == 'transactions'}
+        if any(table == 'accounts' for table, _ in rows):
+            self._load_accounts(conn)
+            # Rename / new party: पुरानी rows के नाम भी नए सिरे से
+            self.trans_df = self._with_names(self.trans_df)
+
+        if not trans_ids:
+            return
+        if len(trans_ids) > self.FULL_RELOAD_AT:
+            self._load_transactions(conn)
+            return
+
+        # 1. Updated / deleted (या पुराने id पर दोबारा insert हुई) rows
+        patched_ids = sorted(i for i in trans_ids if i <= self.last_id)
+        parts = [self.trans_df[~self.trans_df['id'].isin(patched_ids)]]
+        for start in range(0, len(patched_ids), self.CHUNK):
+            chunk = patched_ids[start:start + self.CHUNK]
+            marks = ",".join("?" * len(chunk))
+            parts.append(self._read(conn, f"SELECT {self.COLUMNS} FROM transactions WHERE id IN ({marks})", chunk))
+
+        # 2. New rows: सिर्फ last_id के बाद वाली
+        parts.append(self._read(conn, f"SELECT {self.COLUMNS} FROM transactions WHERE id > ? ORDER BY id", (self.last_id,)))
+
+        parts = [parts[0]] + [self._with_names(p) for p in parts[1:]]
+        parts = [p for p in parts if not p.empty]
+        if parts:
+            merged = pd.concat(parts, ignore_index=True)
+            if patched_ids:
+                merged = merged.sort_values('id', ignore_index=True)
+        else:
+            merged = self.trans_df.iloc[0:0]
+
+        # नया DataFrame बनाकर swap करो ताकि पुराना snapshot पढ़ रहे sessions पर असर न हो
+        self.trans_df = merged
+        if not merged.empty:
+            self.last_id = max(self.last_id, int(merged['id'].max()))
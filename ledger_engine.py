@@ -0,0 +1,440 @@
+import datetime
+from difflib import SequenceMatcher
+
+import numpy as np
+import pandas as pd
+
+from db_pool import connection
+from write_queue import write
+from money import to_paise, to_rupees, rupees_frame
+
+# Transactions account ids (from_id / to_id) रखते हैं; नाम सिर्फ दिखाने के लिए join होते हैं
+NAMES_JOIN = """
+    LEFT JOIN accounts f ON f.id = t.from_id
+    LEFT JOIN accounts o ON o.id = t.to_id
+"""
+DISPLAY_COLUMNS = (
+    "t.id, t.day AS date, f.name AS from_acc, o.name AS to_acc, t.amount, t.note, t.txn_type, t.status"
+)
+
+# Sidebar, filters और transactions.txn_type / status में यही values
+TXN_TYPES = ["Payment", "Contract/Deal", "Adjustment"]
+TXN_STATUSES = ["N/A", "Work Started", "In Progress", "Completed"]
+
+# transactions.day = date as days since 1970-01-01 (generated column, see setup_db);
+# range filters और indexes इसी integer पर चलते हैं
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def day_number(d):
+    """date / datetime -> transactions.day"""
+    if isinstance(d, datetime.datetime):
+        d = d.date()
+    return (d - EPOCH).days
+
+
+def dates_from_days(days):
+    """transactions.day values -> datetime64 column, without parsing any text"""
+    return pd.to_datetime(pd.Series(days, dtype="float64"), unit="D")
+
+
+def _account_id(conn, name):
+    row = conn.execute("SELECT id FROM accounts WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+# --- STATEMENT ENGINE ---
+# दोनों legs अलग-अलग लिखे हैं ताकि हर हिस्सा (from_id/to_id, day, id) index पर
+# range scan करे; OR लिखने पर SQLite day वाला हिस्सा index में इस्तेमाल नहीं करता।
+# Self-transfer (from = to) दूसरे leg से बाहर है ताकि वो दो बार न आए।
+STATEMENT_SQL = f"""
+    SELECT {DISPLAY_COLUMNS}
+    FROM (
+        SELECT * FROM transactions WHERE from_id = :acc AND day BETWEEN :start AND :end
+        UNION ALL
+        SELECT * FROM transactions WHERE to_id = :acc AND from_id <> :acc AND day BETWEEN :start AND :end
+    ) t
+    {NAMES_JOIN}
+    ORDER BY t.day, t.id
+"""
+
+# Balance brought forward: start_date से पहले का net (in - out), एक ही aggregate में
+CARRIED_FORWARD_SQL = """
+    SELECT COALESCE(SUM(CASE WHEN to_id = :acc THEN amount ELSE -amount END), 0)
+    FROM (
+        SELECT to_id, amount FROM transactions WHERE from_id = :acc AND day < :start
+        UNION ALL
+        SELECT to_id, amount FROM transactions WHERE to_id = :acc AND from_id <> :acc AND day < :start
+    )
+"""
+
+
+def get_statement(account, start_date, end_date):
+    """Transactions of one account between start_date and end_date (inclusive), ordered by date + id"""
+    with connection() as conn:
+        params = {"acc": _account_id(conn, account), "start": day_number(start_date), "end": day_number(end_date)}
+        df = rupees_frame(pd.read_sql_query(STATEMENT_SQL, conn, params=params))
+    df['date'] = dates_from_days(df['date'])
+    return df
+
+
+def get_carried_forward(account, start_date):
+    """Net movement of an account before start_date (money in minus money out), in rupees"""
+    with connection() as conn:
+        params = {"acc": _account_id(conn, account), "start": day_number(start_date)}
+        return to_rupees(conn.execute(CARRIED_FORWARD_SQL, params).fetchone()[0])
+
+
+def build_ledger(book, df, opening_total, start_date):
+    """
+    Debit/Credit/Balance statement for `book` from its statement rows (sorted by date + id).
+
+    First row is the balance brought forward; the running balance is a cumsum
+    seeded with it, so no per-row Python loop is needed. The sum runs in
+    integer paise, so the closing balance is exact however long the book is.
+    """
+    is_in = (df['to_acc'] == book).to_numpy()
+    paise = to_paise(df['amount']).to_numpy()
+    opening_paise = to_paise(opening_total)
+
+    balance = to_rupees(np.cumsum(np.concatenate(([opening_paise], np.where(is_in, paise, -paise)))))
+    amount = to_rupees(paise)
+    opening_total = to_rupees(opening_paise)
+
+    return pd.DataFrame({
+        "Date": [start_date] + df['date'].dt.date.tolist(),
+        "Particular": ["Opening Balance"] + np.where(
+            is_in, "From " + df['from_acc'].astype(str), "To " + df['to_acc'].astype(str)
+        ).tolist(),
+        "Type": [None] + df['txn_type'].tolist(),
+        "Status": [None] + df['status'].tolist(),
+        "Debit": np.concatenate(([max(opening_total, 0.0)], np.where(is_in, amount, 0.0))),
+        "Credit": np.concatenate(([abs(min(opening_total, 0.0))], np.where(is_in, 0.0, amount))),
+        "Balance": balance,
+        "Note": ["Balance brought forward"] + df['note'].tolist(),
+        # Opening row has no ID; nullable Int64 keeps the column numeric for display
+        "ID": pd.array([pd.NA] + df['id'].tolist(), dtype="Int64"),
+    })
+
+
+# --- TRIAL BALANCE ENGINE ---
+# as_of तक हर account का total in / out, एक grouped query में
+TRIAL_TOTALS_SQL = """
+    SELECT a.name AS account_name, x.total_in, x.total_out
+    FROM (
+        SELECT account_id, SUM(amt_in) AS total_in, SUM(amt_out) AS total_out
+        FROM (
+            SELECT to_id AS account_id, amount AS amt_in, 0 AS amt_out FROM transactions WHERE day <= :as_of
+            UNION ALL
+            SELECT from_id, 0, amount FROM transactions WHERE day <= :as_of
+        )
+        GROUP BY account_id
+    ) x
+    JOIN accounts a ON a.id = x.account_id
+"""
+
+# Same totals for the rows *after* as_of - subtracted from the stored totals when that side is smaller
+TRIAL_TAIL_SQL = TRIAL_TOTALS_SQL.replace("day <= :as_of", "day > :as_of")
+
+# Unary + stops SQLite from using the day index: for a cut-off in the middle of
+# the ledger one sequential scan beats hundreds of thousands of index lookups
+TRIAL_SCAN_SQL = TRIAL_TOTALS_SQL.replace("day <= :as_of", "+day <= :as_of")
+
+# दोनों तरफ की rows गिनो (सिर्फ day index पढ़ता है) ताकि छोटा हिस्सा aggregate हो
+AS_OF_SPLIT_SQL = """
+    SELECT (SELECT COUNT(*) FROM transactions WHERE day <= :as_of),
+           (SELECT COUNT(*) FROM transactions WHERE day > :as_of)
+"""
+
+# Running totals maintained by triggers (setup_db.init_db) - used when there is no as-of cut-off
+STORED_TOTALS_SQL = """
+    SELECT a.name AS account_name, b.total_in, b.total_out
+    FROM account_balances b
+    JOIN accounts a ON a.id = b.account_id
+    WHERE b.txn_count > 0
+"""
+
+# एक ही query में साल के सारे opening balances (Debit = +, Credit = -)
+OPENING_BALANCES_SQL = """
+    SELECT a.name AS account_name, CASE WHEN ob.type = 'Debit' THEN ob.balance ELSE -ob.balance END AS opening
+    FROM opening_balances ob
+    JOIN accounts a ON a.id = ob.account_id
+    WHERE ob.financial_year = :fy
+"""
+
+# One account's opening balance for one year (Books tab, dashboard cards)
+OPENING_BALANCE_SQL = """
+    SELECT ob.balance, ob.type
+    FROM opening_balances ob
+    JOIN accounts a ON a.id = ob.account_id
+    WHERE a.name = ? AND ob.financial_year = ?
+"""
+
+
+def trial_balance(fin_year, as_of=None):
+    """
+    Opening, Total In, Total Out and Net Balance for every account.
+
+    Opening balances come from `fin_year`; totals cover every transaction up to
+    and including `as_of` (all of them when as_of is None).
+    """
+    with connection() as conn:
+        if as_of is None:
+            totals = pd.read_sql_query(STORED_TOTALS_SQL, conn)
+        else:
+            params = {"as_of": day_number(as_of)}
+            head_rows, tail_rows = conn.execute(AS_OF_SPLIT_SQL, params).fetchone()
+            if min(head_rows, tail_rows) * 5 > head_rows + tail_rows:
+                totals = pd.read_sql_query(TRIAL_SCAN_SQL, conn, params=params)
+            elif head_rows <= tail_rows:
+                totals = pd.read_sql_query(TRIAL_TOTALS_SQL, conn, params=params)
+            else:
+                # Recent cut-off: stored totals minus whatever was posted after as_of
+                stored = pd.read_sql_query(STORED_TOTALS_SQL, conn).set_index("account_name")
+                tail = pd.read_sql_query(TRIAL_TAIL_SQL, conn, params=params).set_index("account_name")
+                totals = stored.sub(tail, fill_value=0).reset_index()
+        opening = pd.read_sql_query(OPENING_BALANCES_SQL, conn, params={"fy": fin_year})
+
+    # सारा हिसाब integer paise में, rupees सिर्फ आखिर में
+    report = opening.merge(totals, on="account_name", how="outer")
+    amounts = ["opening", "total_in", "total_out"]
+    report[amounts] = report[amounts].apply(pd.to_numeric).fillna(0).astype("int64")
+    report = report.sort_values("account_name", ignore_index=True)
+    report["net"] = report["opening"] + report["total_in"] - report["total_out"]
+    report[amounts + ["net"]] = to_rupees(report[amounts + ["net"]])
+
+    return report.rename(columns={
+        "account_name": "Account Name",
+        "opening": "Opening",
+        "total_in": "Total In",
+        "total_out": "Total Out",
+        "net": "Net Balance",
+    })[["Account Name", "Opening", "Total In", "Total Out", "Net Balance"]]
+
+
+# --- ANALYTICS (daily_totals rollup, kept in sync by triggers) ---
+INFLOW_TRENDS_SQL = """
+    SELECT d.day, a.name AS to_acc, d.total AS amount
+    FROM accounts a
+    JOIN daily_totals d ON d.account_id = a.id AND d.direction = 'in'
+    WHERE a.name IN ({marks})
+    ORDER BY d.day
+"""
+
+
+def inflow_trends(accounts, monthly=False):
+    """
+    Money received by each of `accounts` per day (or per month), oldest first.
+
+    Reads the per-day rollup, so the cost grows with the number of days, not
+    transactions. `period` is a datetime64 column (month start when monthly).
+    """
+    marks = ", ".join("?" * len(accounts))
+    with connection() as conn:
+        df = pd.read_sql_query(INFLOW_TRENDS_SQL.format(marks=marks), conn, params=list(accounts))
+    df.insert(0, 'period', dates_from_days(df.pop('day')))
+    if monthly:
+        df['period'] = df['period'].dt.to_period('M').dt.to_timestamp()
+        df = df.groupby(['period', 'to_acc'], as_index=False)['amount'].sum()
+    return rupees_frame(df)
+
+
+# --- FULL-TEXT SEARCH (transactions_fts, kept in sync by triggers) ---
+# इससे ज़्यादा matches पर bm25 ranking महंगी है, तब newest first दिखाओ
+RANK_LIMIT = 10000
+
+
+def _match_expression(text):
+    """Every word must match, each as a prefix: 'rah fee' -> "rah"* "fee"*"""
+    terms = text.split()
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
+def search_transactions(text, limit=50, offset=0, date_from=None, date_to=None,
+                        min_amount=None, max_amount=None, txn_types=None, statuses=None):
+    """
+    Ranked, paginated search over note / accounts / amount / date / type / status.
+
+    txn_types / statuses are lists of allowed values (None or empty = any).
+    Returns (page_df, total_matches); page_df also carries each row's version
+    for delete_transaction(). Empty text with filters just lists the filtered
+    rows, newest first.
+    """
+    where, params = [], {"limit": limit, "offset": offset}
+    match = _match_expression(text or "")
+    if match:
+        source = "transactions_fts JOIN transactions t ON t.id = transactions_fts.rowid"
+        where.append("transactions_fts MATCH :match")
+        params["match"] = match
+    else:
+        source = "transactions t"
+
+    if date_from is not None:
+        where.append("t.day >= :date_from")
+        params["date_from"] = day_number(date_from)
+    if date_to is not None:
+        where.append("t.day <= :date_to")
+        params["date_to"] = day_number(date_to)
+    if min_amount is not None:
+        where.append("t.amount >= :min_amount")
+        params["min_amount"] = to_paise(min_amount)
+    if max_amount is not None:
+        where.append("t.amount <= :max_amount")
+        params["max_amount"] = to_paise(max_amount)
+    for column, values in (("txn_type", txn_types), ("status", statuses)):
+        if values:
+            keys = [f"{column}_{i}" for i in range(len(values))]
+            where.append(f"t.{column} IN ({', '.join(':' + k for k in keys)})")
+            params.update(zip(keys, values))
+
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    with connection() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM {source} {where_sql}", params).fetchone()[0]
+        order = "transactions_fts.rank" if match and total <= RANK_LIMIT else "t.id DESC"
+        page = rupees_frame(pd.read_sql_query(
+            f"SELECT {DISPLAY_COLUMNS}, t.version FROM {source} {NAMES_JOIN} {where_sql} "
+            f"ORDER BY {order} LIMIT :limit OFFSET :offset",
+            conn, params=params
+        ))
+    page['date'] = dates_from_days(page['date'])
+    return page, total
+
+
+# --- DUPLICATE PARTY DETECTION (party_trigrams, kept in sync by triggers) ---
+# bm25 से इतने candidates लो, फिर सिर्फ इन्हें SequenceMatcher से score करो
+CANDIDATES = 50
+
+
+def find_similar_parties(name, limit=5, cutoff=0.6):
+    """
+    Existing party names that look like `name`, best first, as [(name, score)].
+
+    The trigram index narrows the directory down to a few candidates; the score
+    is the same SequenceMatcher ratio difflib.get_close_matches uses.
+    """
+    low = name.strip().lower()
+    if not low:
+        return []
+
+    with connection() as conn:
+        if len(low) < 3:
+            # Trigram index को कम से कम 3 अक्षर चाहिए
+            rows = conn.execute("SELECT name FROM accounts WHERE name = ? COLLATE NOCASE", (low,)).fetchall()
+        else:
+            grams = {low[i:i + 3] for i in range(len(low) - 2)}
+            match = " OR ".join('"' + g.replace('"', '""') + '"' for g in grams)
+            rows = conn.execute(
+                "SELECT name FROM party_trigrams WHERE party_trigrams MATCH ? ORDER BY rank LIMIT ?",
+                (match, CANDIDATES)
+            ).fetchall()
+
+    scored = []
+    for (candidate,) in rows:
+        score = SequenceMatcher(None, low, str(candidate).strip().lower()).ratio()
+        if score >= cutoff:
+            scored.append((candidate, score))
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:limit]
+
+
+# --- WRITES: transactions पर हर insert/update/delete यहीं से होता है ---
+def _iso_date(value):
+    """Validate a transaction date and return it as YYYY-MM-DD (raises ValueError)"""
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        value = datetime.date.fromisoformat(value.strip())
+    elif not isinstance(value, datetime.date):
+        raise ValueError(f"Invalid transaction date: {value!r}")
+    return value.isoformat()
+
+
+def _account_ids(conn, *names):
+    ids = []
+    for name in names:
+        acc_id = _account_id(conn, name)
+        if acc_id is None:
+            raise ValueError(f"Unknown account: {name}")
+        ids.append(acc_id)
+    return ids
+
+
+class EditConflict(ValueError):
+    """The row was changed or deleted by someone else after it was read (optimistic locking)"""
+
+    def __init__(self, table, row_id):
+        super().__init__(f"{table} #{row_id} was changed by another user - reload it and try again")
+        self.table = table
+        self.row_id = row_id
+
+
+def _execute_versioned(conn, table, row_id, version, sql, params):
+    """UPDATE / DELETE ... WHERE id=?; with `version` only while the row is still at it"""
+    if version is not None:
+        sql, params = f"{sql} AND version = ?", (*params, int(version))
+    if conn.execute(sql, params).rowcount == 0 and version is not None:
+        raise EditConflict(table, row_id)
+
+
+def get_transaction(txn_id):
+    """One transaction as a dict (display columns + version), or None if it no longer exists"""
+    with connection() as conn:
+        df = rupees_frame(pd.read_sql_query(
+            f"SELECT {DISPLAY_COLUMNS}, t.version FROM transactions t {NAMES_JOIN} WHERE t.id = ?",
+            conn, params=(int(txn_id),)
+        ))
+    if df.empty:
+        return None
+    df['date'] = dates_from_days(df['date'])
+    return df.iloc[0].to_dict()
+
+
+def add_transaction(date, from_acc, to_acc, amount, note, txn_type=None, status=None):
+    """Insert one transaction (accounts by name, amount in rupees); returns the new id"""
+    date, paise = _iso_date(date), to_paise(amount)
+
+    def insert(conn):
+        from_id, to_id = _account_ids(conn, from_acc, to_acc)
+        return conn.execute(
+            "INSERT INTO transactions (date, from_id, to_id, amount, note, txn_type, status) VALUES (?,?,?,?,?,?,?)",
+            (date, from_id, to_id, paise, note, txn_type, status)
+        ).lastrowid
+
+    return write(insert)
+
+
+def update_transaction(txn_id, date, from_acc, to_acc, amount, note, txn_type=None, status=None, version=None):
+    """Overwrite one transaction (accounts by name).
+
+    Pass the `version` it was read at (get_transaction) to get EditConflict
+    instead of silently overwriting someone else's edit.
+    """
+    date, paise = _iso_date(date), to_paise(amount)
+
+    def update(conn):
+        from_id, to_id = _account_ids(conn, from_acc, to_acc)
+        _execute_versioned(
+            conn, "transactions", txn_id, version,
+            "UPDATE transactions SET date=?, from_id=?, to_id=?, amount=?, note=?, txn_type=?, status=?, "
+            "version = version + 1 WHERE id=?",
+            (date, from_id, to_id, paise, note, txn_type, status, int(txn_id))
+        )
+
+    write(update)
+
+
+def delete_transaction(txn_id, version=None):
+    """Permanently delete one transaction (EditConflict if it changed since `version`)"""
+    write(lambda conn: _execute_versioned(
+        conn, "transactions", txn_id, version, "DELETE FROM transactions WHERE id=?", (int(txn_id),)
+    ))
+
+
+def update_account(acc_id, name, phone, address, is_active, version=None):
+    """Edit one party's details (EditConflict if it changed since `version`)"""
+    write(lambda conn: _execute_versioned(
+        conn, "accounts", acc_id, version,
+        "UPDATE accounts SET name=?, phone=?, address=?, is_active=?, version = version + 1 WHERE id=?",
+        (name, phone, address, is_active, int(acc_id))
+    ))
@@ -0,0 +1,195 @@
+import csv
+import datetime
+import gzip
+import io
+import re
+import tempfile
+
+from db_pool import connection
+from ledger_engine import (
+    NAMES_JOIN, STATEMENT_SQL, CARRIED_FORWARD_SQL, OPENING_BALANCE_SQL,
+    EPOCH, day_number, trial_balance, _account_id
+)
+from money import paise_str, to_paise, to_rupees
+
+# --- FULL LEDGER CSV (batched) ---
+# एक बार में इतनी rows पढ़ो/लिखो; file बनाते समय rows की memory इसी पर टिकी रहती है
+CSV_BATCH = 5000
+# इससे बड़ी file RAM की जगह disk पर चली जाती है
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+# zlib का default level: 9 से ~2x तेज़, file लगभग उतनी ही छोटी
+GZIP_LEVEL = 6
+
+CSV_HEADER = ["id", "date", "from_acc", "to_acc", "amount", "note", "txn_type", "status"]
+CSV_SQL = f"""
+    SELECT t.id, t.date, f.name, o.name, t.amount, t.note, t.txn_type, t.status
+    FROM transactions t
+    {NAMES_JOIN}
+    ORDER BY t.id
+"""
+
+
+def export_transactions_csv(compress=False):
+    """
+    Every transaction as CSV (rupee amounts), oldest first.
+
+    Rows are fetched from a cursor CSV_BATCH at a time and written straight
+    into a spooled temp file (gzip-compressed when `compress`), so the rows
+    are never all held as Python objects. The file itself is in RAM up to
+    SPOOL_MAX_BYTES, and a caller that hands it to st.download_button holds
+    it whole in any case. Returns that file rewound to the start; the caller
+    closes it.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    sink = gzip.GzipFile(fileobj=spool, mode="wb", compresslevel=GZIP_LEVEL) if compress else spool
+    text = io.TextIOWrapper(sink, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(CSV_HEADER)
+
+    with connection() as conn:
+        cursor = conn.execute(CSV_SQL)
+        while True:
+            rows = cursor.fetchmany(CSV_BATCH)
+            if not rows:
+                break
+            writer.writerows(
+                (txn_id, date, from_acc, to_acc, paise_str(amount), note, txn_type, status)
+                for txn_id, date, from_acc, to_acc, amount, note, txn_type, status in rows
+            )
+
+    # Wrapper हटाओ पर spool खुला रहे; GzipFile.close() सिर्फ gzip trailer लिखता है
+    text.flush()
+    text.detach()
+    if compress:
+        sink.close()
+    spool.seek(0)
+    return spool
+
+
+# --- EXCEL WORKBOOK (write-only, streamed) ---
+XLSX_BATCH = 5000
+MONEY_FORMAT = "#,##0.00"
+
+STATEMENT_HEADER = ["Date", "Particular", "Type", "Status", "Debit", "Credit", "Balance", "Note", "ID"]
+OPENING_LIST_SQL = """
+    SELECT ob.financial_year, a.name, ob.type, ob.balance
+    FROM opening_balances ob
+    JOIN accounts a ON a.id = ob.account_id
+    ORDER BY ob.financial_year, a.name
+"""
+DIRECTORY_SQL = "SELECT id, name, phone, address, is_active FROM accounts ORDER BY name"
+
+
+def _sheet_title(name, used):
+    """Excel sheet name: 31 chars max, no []:*?/\\ and unique within the workbook"""
+    base = re.sub(r"[\[\]:*?/\\]", "_", str(name)).strip("'")[:31] or "Sheet"
+    title, n = base, 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+
+def _header(ws, names):
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    cells = []
+    for name in names:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = Font(bold=True)
+        cells.append(cell)
+    ws.append(cells)
+
+
+def _money(ws, paise):
+    """Rupee number cell with a 2-decimal format (value computed from exact paise)"""
+    from openpyxl.cell import WriteOnlyCell
+
+    cell = WriteOnlyCell(ws, value=to_rupees(paise))
+    cell.number_format = MONEY_FORMAT
+    return cell
+
+
+def _write_trial_balance(ws, fin_year, as_of):
+    report = trial_balance(fin_year, as_of)
+    _header(ws, list(report.columns))
+    for name, *amounts in report.itertuples(index=False):
+        ws.append([name] + [_money(ws, to_paise(a)) for a in amounts])
+
+
+def _write_statement(ws, conn, account, start_date, end_date, fin_year):
+    """
+    Books-tab statement for one account: opening row, then every entry in the
+    window with a running balance. Rows come from a STATEMENT_SQL cursor in
+    batches and the balance is carried in integer paise, so the statement is
+    never loaded whole (the written sheet is, as part of the finished file).
+    """
+    acc = _account_id(conn, account)
+    row = conn.execute(OPENING_BALANCE_SQL, (account, fin_year)).fetchone()
+    opening = 0 if row is None else (row[0] if row[1] == "Debit" else -row[0])
+    start = day_number(start_date)
+    opening += conn.execute(CARRIED_FORWARD_SQL, {"acc": acc, "start": start}).fetchone()[0]
+
+    _header(ws, STATEMENT_HEADER)
+    ws.append([start_date, "Opening Balance", None, None,
+               _money(ws, max(opening, 0)), _money(ws, -min(opening, 0)), _money(ws, opening),
+               "Balance brought forward", None])
+
+    balance = opening
+    cursor = conn.execute(STATEMENT_SQL, {"acc": acc, "start": start, "end": day_number(end_date)})
+    while True:
+        rows = cursor.fetchmany(XLSX_BATCH)
+        if not rows:
+            break
+        for txn_id, day, from_acc, to_acc, amount, note, txn_type, status in rows:
+            is_in = to_acc == account
+            balance += amount if is_in else -amount
+            ws.append([
+                EPOCH + datetime.timedelta(days=day),
+                f"From {from_acc}" if is_in else f"To {to_acc}",
+                txn_type, status,
+                _money(ws, amount if is_in else 0), _money(ws, 0 if is_in else amount), _money(ws, balance),
+                note, txn_id,
+            ])
+
+
+def export_workbook(accounts, start_date, end_date, fin_year, as_of=None):
+    """
+    One .xlsx with a Trial Balance sheet, a statement sheet per account in
+    `accounts`, the Opening Balances list and the Party Directory.
+
+    Uses openpyxl's write-only mode: each row is serialised as it is appended
+    (nothing is kept per cell), and the finished workbook goes into a spooled
+    temp file. That file is in RAM up to SPOOL_MAX_BYTES, and whole once it
+    is handed to st.download_button. Returns it rewound to the start; the
+    caller closes it.
+    """
+    # openpyxl (~0.3 s import) सिर्फ Excel export पर लोड होता है
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    used = set()
+
+    _write_trial_balance(wb.create_sheet(_sheet_title("Trial Balance", used)), fin_year, as_of)
+
+    with connection() as conn:
+        for account in accounts:
+            ws = wb.create_sheet(_sheet_title(account, used))
+            _write_statement(ws, conn, account, start_date, end_date, fin_year)
+
+        ws = wb.create_sheet(_sheet_title("Opening Balances", used))
+        _header(ws, ["Financial Year", "Account Name", "Type", "Balance"])
+        for fy, name, typ, balance in conn.execute(OPENING_LIST_SQL):
+            ws.append([fy, name, typ, _money(ws, balance)])
+
+        ws = wb.create_sheet(_sheet_title("Party Directory", used))
+        _header(ws, ["ID", "Name", "Phone", "Address", "Status"])
+        for acc_id, name, phone, address, is_active in conn.execute(DIRECTORY_SQL):
+            ws.append([acc_id, name, phone, address, "Active" if is_active == 1 else "Inactive"])
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    wb.save(spool)
+    spool.seek(0)
+    return spool
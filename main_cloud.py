@@ -1,58 +1,74 @@
+import time
+_run_start = time.perf_counter()  # startup timings (startup.py)
+
 import streamlit as st
-import io
-import urllib.parse
+import os
 import sqlite3
+import urllib.parse
 import pandas as pd
-from fpdf import FPDF
-import plotly.express as px
 from datetime import datetime
-import plotly.graph_objects as go
-import urllib.parse
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
 from io import BytesIO
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import difflib # Ensure this is at the top of your file
-from difflib import SequenceMatcher
-from setup_db import init_db, reset_database, upgrade_database
+from setup_db import rebuild_account_balances
+from db_pool import connection
+from write_queue import write, writer
+from ledger_cache import LedgerCache
+from ledger_export import export_transactions_csv, export_workbook
+from ledger_backup import (
+    create_backup, create_incremental_backup, latest_full_backup, deltas_after, read_backup, spool_uploads, prepare_restore,
+    restore_database, COMPRESSORS
+)
+from money import to_paise, to_rupees, rupees_frame
+from ledger_engine import (
+    get_statement, get_carried_forward, build_ledger, trial_balance, search_transactions,
+    find_similar_parties, add_transaction, update_transaction, delete_transaction, update_account,
+    get_transaction, EditConflict,
+    inflow_trends, OPENING_BALANCE_SQL, TXN_TYPES, TXN_STATUSES
+)
 import streamlit.components.v1 as components
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from io import BytesIO
+from streamlit.errors import StreamlitAPIException
+import startup
+
+# Plotly, reportlab और openpyxl अपने chart / PDF / Excel बटन पर ही import होते हैं
+startup.timings.setdefault("imports", (time.perf_counter() - _run_start) * 1000)
+
+def migration_progress():
+    """progress(title, done, total) for setup_db.migrate - the bar only shows up if a migration runs"""
+    bars = []
+    def update(title, done, total):
+        if not bars:
+            bars.append(st.progress(0.0))
+        bars[0].progress(done / total, text=f"🛠️ Database upgrade: {title} ({done:,}/{total:,})")
+    return update
 
-# Initialize the database from setup_db.py
-init_db()
+# Schema bootstrap: process में एक बार; up-to-date DB पर बस एक PRAGMA user_version read
+startup.ensure_schema(progress=migration_progress())
 
 # reset_database()
 
 # upgrade_database()
 
 # --- CLEAN DATABASE HELPERS ---
-DB_FILE = 'business_ledger.db'
+# All access goes through the pooled, WAL-configured connections in db_pool.py;
+# writes are handed to the single writer thread in write_queue.py (group commit + busy retry)
 
 def get_query(query, params=()):
-    """Use this for all SELECT statements"""
-    with sqlite3.connect(DB_FILE) as conn:
-        return pd.read_sql_query(query, conn, params=params)
+    """Use this for all SELECT statements (amount/balance columns come back in rupees)"""
+    with connection() as conn:
+        return rupees_frame(pd.read_sql_query(query, conn, params=params))
 
 def run_action(query, params=()):
-    """Use this for all INSERT, UPDATE, DELETE statements"""
-    with sqlite3.connect(DB_FILE) as conn:
-        curr = conn.cursor()
-        curr.execute(query, params)
-        conn.commit()
-
-try:
-    # This adds the column if it doesn't exist. DEFAULT 1 keeps everyone active.
-    run_action("ALTER TABLE accounts ADD COLUMN is_active INTEGER DEFAULT 1")
-except Exception:
-    pass # Column already exists
+    """Use this for all INSERT, UPDATE, DELETE statements (pass amounts as to_paise(...)); returns rows changed"""
+    return write(lambda conn: conn.execute(query, params).rowcount)
 
 # Alias for compatibility if your dashboard uses 'run_query'
 def run_query(query, params=()):
     return get_query(query, params)
 
+@st.cache_resource
+def get_ledger_cache():
+    """One shared copy of accounts/transactions for all sessions (refreshed via the changes journal)"""
+    return LedgerCache()
+
 # --- INITIALIZATION (Ensure these are at the top of your script) ---
 if 'should_reset' not in st.session_state:
     st.session_state['should_reset'] = False
@@ -67,11 +83,14 @@ def trigger_reset():
 def fmt_date(d):
     return d.strftime("%d-%m-%Y")
 
-pdfmetrics.registerFont(
-    TTFont("Noto", "fonts/NotoSans-Regular.ttf")
-)
+# date columns अब datetime64 हैं; tables में सिर्फ तारीख दिखाओ
+DATE_COLUMN_CONFIG = {"date": st.column_config.DateColumn("date", format="YYYY-MM-DD")}
 
 def generate_directory_pdf(df):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    startup.register_pdf_font()
+
     buffer = BytesIO()
     # Create the canvas
     c = canvas.Canvas(buffer, pagesize=A4)
@@ -130,7 +149,49 @@ def generate_directory_pdf(df):
     buffer.close()
     return pdf_data
 
+def filter_directory(directory_df, filter_status, search_query):
+    """Party Directory view: status filter + name/phone search"""
+    view_df = directory_df
+
+    # Filter 1: By Status (Active vs Hidden)
+    if filter_status == "Active Only":
+        view_df = view_df[view_df['is_active'] == 1]
+
+    # Filter 2: By Search Query
+    if search_query:
+        view_df = view_df[
+            view_df['name'].str.contains(search_query, case=False, na=False) |
+            view_df['phone'].str.contains(search_query, case=False, na=False)
+        ]
+    return view_df
+
+@st.cache_data(max_entries=20, show_spinner="Building PDF...")
+def build_directory_pdf(filter_status, search_query, data_version):
+    """Directory PDF for one (filter, search, data version); data_version only keys the cache"""
+    directory_df = get_query("SELECT id, name, phone, address, is_active FROM accounts")
+    return generate_directory_pdf(filter_directory(directory_df, filter_status, search_query))
+
+# st.download_button हर download (bytes, file object या callable का result) को एक bytes object बनाकर
+# अपने in-memory media store में रखता है, और SpooledTemporaryFile लेता ही नहीं - इसलिए बनी हुई
+# file यहाँ एक बार पूरी RAM में आती ही है। Batching सिर्फ file बनाने की memory बचाती है;
+# बड़े ledger के लिए .csv.gz चुनें (RAM में कई गुना छोटी)।
+def ledger_csv_bytes(compress):
+    """Download-time callback: build the CSV in a temp file, then hand Streamlit the finished bytes"""
+    with export_transactions_csv(compress) as export_file:
+        return export_file.read()
+
+# CSV की तरह: write-only mode workbook बनाने की memory बचाता है, पर तैयार .xlsx download के समय
+# Streamlit पूरी RAM में रखता है (ऊपर ledger_csv_bytes वाली बात)
+def ledger_xlsx_bytes(accounts, start_date, end_date, fin_year):
+    """Download-time callback: write the multi-sheet workbook (write-only mode), then hand Streamlit the finished bytes"""
+    with export_workbook(accounts, start_date, end_date, fin_year) as export_file:
+        return export_file.read()
+
 def generate_pdf(book, start_date, end_date, df, money_in, money_out, net_bal, msg_hindi):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    startup.register_pdf_font()
+
     buffer = BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
@@ -196,13 +257,9 @@ def save_and_reset():
     raw_note = st.session_state.get("sb_note", "")
     t_type = st.session_state.get("sb_t_type", "Payment")
     t_status = st.session_state.get("sb_t_status", "N/A")
-    
-    # फाइनल नोट जो DB में जाएगा
-    n = f"[{t_type}] | Status: {t_status} | {raw_note}"
 
-    # 2. Save to Database
-    run_action("INSERT INTO transactions (date, from_acc, to_acc, amount, note) VALUES (?,?,?,?,?)",
-               (d.strftime("%Y-%m-%d"), f, t, a, n))
+    # 2. Save to Database (type/status अपने columns में, note में नहीं)
+    add_transaction(d, f, t, a, raw_note, t_type, t_status)
 
 
     # 3. FORCE INITIALIZATION (The Update)
@@ -212,8 +269,13 @@ def save_and_reset():
     st.session_state["sb_amt"] = 0.0
     st.session_state["sb_note"] = ""
             
-    st.toast(f"✅ Saved ₹{a} Successfully!", icon="💰")
-    st.rerun()
+    # Sidebar fragment अगली run में इन दोनों accounts के नए balance दिखाता है
+    st.session_state["last_saved"] = (f, t)
+
+    # Keyed rerun वाले callback से element नहीं दिखा सकते; entry_form इसे अगली run में दिखाता है
+    st.session_state["save_toast"] = f"✅ Saved ₹{a} Successfully!"
+    # पूरी app नहीं: सिर्फ entry form और top cards दोबारा चलें
+    st.rerun(["entry_form", "metrics"])
 
 # --- 1. SETTINGS & SECURITY ---
 st.set_page_config(page_title="Ledger 2026", layout="wide", page_icon="📈")
@@ -255,12 +317,11 @@ def current_fin_year():
     else:
         return f"{year}-{str(year+1)[-2:]}"
 
+# Opening Balance tab और Trial Balance में यही साल दिखते हैं
+FIN_YEARS = ["2023-24", "2024-25", "2025-26", "2026-27"]
+
 def get_opening_balance(account, fin_year):
-    df = get_query("""
-        SELECT balance, type 
-        FROM opening_balances 
-        WHERE account_name=? AND financial_year=?
-    """, (account, fin_year))
+    df = get_query(OPENING_BALANCE_SQL, (account, fin_year))
 
     if df.empty:
         return 0
@@ -270,110 +331,148 @@ def get_opening_balance(account, fin_year):
 
     return bal if typ == "Debit" else -bal
 
+def get_account_totals():
+    """total_in / total_out / txn_count per account, from the trigger-maintained account_balances table"""
+    return get_query("""
+        SELECT a.name AS account_name, b.total_in, b.total_out, b.txn_count
+        FROM account_balances b JOIN accounts a ON a.id = b.account_id
+    """).set_index('account_name')
+
+def get_bal(name, acc_totals):
+    """Opening balance (current financial year) + everything received - everything paid"""
+    inflow = acc_totals['total_in'].get(name, 0.0)
+    outflow = acc_totals['total_out'].get(name, 0.0)
+    fy = current_fin_year()
+    open_bal = get_opening_balance(name, fy)
+    return open_bal + inflow - outflow
+
+def business_summary():
+    """(cash, bank, sales, expenses, profit, margin_pct) for the top cards, charts and reports"""
+    acc_totals = get_account_totals()
+    cash = get_bal("Cash", acc_totals)
+    bank = get_bal("Bank", acc_totals)
 
-# --- 3. MAIN APP ---
-if check_password():
-    st.title("📊 Jan Gan Man Public School Ledger 2026 Dashboard")
-    
-    # CALCULATE TOTALS
-    acc_df = run_query("SELECT * FROM accounts")
-    trans_df = run_query("SELECT * FROM transactions")
-    
-    # Business Metrics (Top Row)
-    c1, c2, c3, c4, c5 = st.columns(5) # Added 5th column
-    
-    def get_bal(name):
-        inflow = trans_df[trans_df['to_acc'] == name]['amount'].sum()
-        outflow = trans_df[trans_df['from_acc'] == name]['amount'].sum()
-        fy = current_fin_year()
-        open_bal = get_opening_balance(name, fy)
-        return open_bal + inflow - outflow
-
-    cash = get_bal("Cash")
-    bank = get_bal("Bank")
-    sales = trans_df[trans_df['to_acc'] == 'Sales Income']['amount'].sum()
-    expenses = trans_df[trans_df['to_acc'] == 'Personal Expense']['amount'].sum()
-    
     # NEW MATH: Profit calculation
     # --- Calculation Logic ---
     # Sales: Sum of amount where 'from_acc' is 'Sales Income'
-    sales = trans_df[trans_df['from_acc'] == 'Sales Income']['amount'].sum()
+    sales = acc_totals['total_out'].get('Sales Income', 0.0)
 
     # Expenses: Sum of amount where 'to_acc' is 'Personal Expense'
-    expenses = trans_df[trans_df['to_acc'] == 'Personal Expense']['amount'].sum()
+    expenses = acc_totals['total_in'].get('Personal Expense', 0.0)
 
     # Profit Math
     profit = sales - expenses
     # Calculate Margin %
     margin_pct = (profit / sales * 100) if sales > 0 else 0
+    return cash, bank, sales, expenses, profit, margin_pct
+
+def rerun_fragment():
+    """Rerun just the calling fragment - or the whole app if the fragment is running as part of a full run"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def get_ledger_version():
+    """changes journal position - bumps on every write (cache keys)"""
+    with connection() as conn:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+def has_transactions():
+    """कम से कम एक entry है? - एक index lookup, पूरी table पढ़े बिना"""
+    with connection() as conn:
+        return bool(conn.execute("SELECT EXISTS(SELECT 1 FROM transactions)").fetchone()[0])
+
+# Page हिस्सों में बँटा है (st.fragment): किसी हिस्से का widget सिर्फ उसी हिस्से को दोबारा चलाता है।
+# Sidebar की entry top cards को तुरंत refresh करती है; बाकी tabs / दूसरे users की entries
+# top cards इतने seconds में पकड़ लेते हैं।
+METRICS_REFRESH = 30
+
+
+# --- 3. MAIN APP ---
+if check_password():
+    st.title("📊 Jan Gan Man Public School Ledger 2026 Dashboard")
     
-    # UI: 5 Columns for 5 Cards
-    c1, c2, c3, c4, c5 = st.columns(5)
-
-    c1.metric("💵 Cash in Hand", f"₹{cash:,.2f}")
-    c2.metric("🏦 Bank Balance", f"₹{bank:,.2f}")
-    c3.metric("📈 Total Sales", f"₹{sales:,.2f}")
-    c4.metric("📉 Total Expenses", f"₹{expenses:,.2f}", delta_color="inverse")
-    c5.metric("🎯 Margin %", f"{margin_pct:.1f}%", delta=f"{margin_pct:.1f}%")
-    
-    # NEW METRIC: Profit Display
-    # This will turn green if positive, red if negative
-    # Change this line:
-    c5.metric("💰 Net Profit", f"₹{profit:,.2f}", delta=f"{profit:,.2f}")
-    
+    # CALCULATE TOTALS (trigger-maintained account_balances से; हर METRICS_REFRESH पर दोबारा)
+    @st.fragment(key="metrics", run_every=METRICS_REFRESH)
+    def metrics_row():
+        """Business Metrics (Top Row)"""
+        cash, bank, sales, expenses, profit, margin_pct = business_summary()
+
+        # UI: 5 Columns for 5 Cards
+        c1, c2, c3, c4, c5 = st.columns(5)
+
+        c1.metric("💵 Cash in Hand", f"₹{cash:,.2f}")
+        c2.metric("🏦 Bank Balance", f"₹{bank:,.2f}")
+        c3.metric("📈 Total Sales", f"₹{sales:,.2f}")
+        c4.metric("📉 Total Expenses", f"₹{expenses:,.2f}", delta_color="inverse")
+        c5.metric("🎯 Margin %", f"{margin_pct:.1f}%", delta=f"{margin_pct:.1f}%")
+
+        # NEW METRIC: Profit Display
+        # This will turn green if positive, red if negative
+        # Change this line:
+        c5.metric("💰 Net Profit", f"₹{profit:,.2f}", delta=f"{profit:,.2f}")
+
+    metrics_row()
     st.divider()
-   
-    # D. ANALYTICS SECTION (The "Graphs Card")
-    with st.expander("📊 VIEW BUSINESS ANALYTICS & CHARTS", expanded=False):
-        if not trans_df.empty:
-            view = st.radio("Graph Scale:", ["Daily", "Monthly"], horizontal=True, key="graph_toggle")
-            
-            # Prepare Plot Data
-            chart_df = trans_df.copy()
-            chart_df['date'] = pd.to_datetime(chart_df['date'])
-            chart_df['period'] = chart_df['date'].dt.date if view == "Daily" else chart_df['date'].dt.strftime('%b %Y')
-            
-            trends = chart_df.groupby(['period', 'to_acc'])['amount'].sum().reset_index()
-            core_accs = ['Cash', 'Bank', 'Sales Income', 'Personal Expense']
-            plot_df = trends[trends['to_acc'].isin(core_accs)]
 
-            col_chart, col_gauge = st.columns([2, 1])
-            
-            with col_chart:
-                fig_line = px.line(plot_df, x='period', y='amount', color='to_acc', markers=True,
-                                   title=f"{view} Trend Analysis", template="plotly_dark",
-                                   color_discrete_map={"Sales Income": "#00FF00", "Personal Expense": "#FF4B4B"})
-                st.plotly_chart(fig_line, use_container_width=True)
-
-            with col_gauge:
-                fig_gauge = go.Figure(go.Indicator(
-                    mode="gauge+number", value=margin_pct,
-                    number={'suffix': "%"}, title={'text': "Profit Margin"},
-                    gauge={'axis': {'range': [0, 100]}, 'bar': {'color': "#00FF00" if margin_pct > 30 else "#FFA500"}}
-                ))
-                fig_gauge.update_layout(height=300, margin=dict(l=10, r=10, t=50, b=10), template="plotly_dark")
-                st.plotly_chart(fig_gauge, use_container_width=True)
+    @st.fragment
+    def analytics_section():
+        """Toggle + charts; Graph Scale बदलने पर सिर्फ यही हिस्सा दोबारा चलता है"""
+        _, _, sales, expenses, _, margin_pct = business_summary()
+
+        # D. ANALYTICS SECTION (The "Graphs Card")
+        # Toggle (expander नहीं): बंद हो तो charts की query और plotly import बिल्कुल नहीं चलते
+        show_analytics = st.toggle("📊 VIEW BUSINESS ANALYTICS & CHARTS", value=False, key="show_analytics")
+        if show_analytics:
+            with st.container(border=True):
+                if has_transactions():
+                    import plotly.express as px
+                    import plotly.graph_objects as go
+
+                    view = st.radio("Graph Scale:", ["Daily", "Monthly"], horizontal=True, key="graph_toggle")
+
+                    # Prepare Plot Data: daily_totals rollup से, periods पहले से तारीख के क्रम में
+                    core_accs = ['Cash', 'Bank', 'Sales Income', 'Personal Expense']
+                    plot_df = inflow_trends(core_accs, monthly=(view == "Monthly"))
+
+                    col_chart, col_gauge = st.columns([2, 1])
+
+                    with col_chart:
+                        fig_line = px.line(plot_df, x='period', y='amount', color='to_acc', markers=True,
+                                           title=f"{view} Trend Analysis", template="plotly_dark",
+                                           color_discrete_map={"Sales Income": "#00FF00", "Personal Expense": "#FF4B4B"})
+                        if view == "Monthly":
+                            fig_line.update_xaxes(dtick="M1", tickformat="%b %Y")
+                        st.plotly_chart(fig_line, use_container_width=True)
+
+                    with col_gauge:
+                        fig_gauge = go.Figure(go.Indicator(
+                            mode="gauge+number", value=margin_pct,
+                            number={'suffix': "%"}, title={'text': "Profit Margin"},
+                            gauge={'axis': {'range': [0, 100]}, 'bar': {'color': "#00FF00" if margin_pct > 30 else "#FFA500"}}
+                        ))
+                        fig_gauge.update_layout(height=300, margin=dict(l=10, r=10, t=50, b=10), template="plotly_dark")
+                        st.plotly_chart(fig_gauge, use_container_width=True)
+
+                    st.divider()
+                    # Bar Chart Comparison
+                    comp_df = pd.DataFrame({"Category": ["Sales", "Expenses"], "Amount": [sales, expenses]})
+                    fig_bar = px.bar(comp_df, x="Category", y="Amount", color="Category", text_auto='.2s',
+                                     title="Revenue vs Expenditure", template="plotly_dark",
+                                     color_discrete_map={"Sales": "#00FF00", "Expenses": "#FF4B4B"})
+                    st.plotly_chart(fig_bar, use_container_width=True)
+                else:
+                    st.info("No data available to generate graphs.")
+
+    analytics_section()
 
-            st.divider()
-            # Bar Chart Comparison
-            comp_df = pd.DataFrame({"Category": ["Sales", "Expenses"], "Amount": [sales, expenses]})
-            fig_bar = px.bar(comp_df, x="Category", y="Amount", color="Category", text_auto='.2s',
-                             title="Revenue vs Expenditure", template="plotly_dark",
-                             color_discrete_map={"Sales": "#00FF00", "Expenses": "#FF4B4B"})
-            st.plotly_chart(fig_bar, use_container_width=True)
-        else:
-            st.info("No data available to generate graphs.")
-                        
     # --- 2. THE SIDEBAR UI ---
-    with st.sidebar:
-        # GUIDELINE BOX FOR USER
-        st.info("""**📖 JGMPS**
-        - **Quick Guide:**
-        - **Sales:** Paid By: `Sales Income` → Received By: `Cash/Bank`
-        - **Expense:** Paid By: `Cash/Bank` → Received By: `Personal Expense`
-        - **Deposit:** Paid By: `Cash` → Received By: `Bank`""")
-                
-        st.header("➕ Add New Transaction")
+    @st.fragment(key="entry_form")
+    def entry_form():
+        """Quick Fill + Add New Transaction: Save सिर्फ यही fragment दोबारा चलाता है"""
+        if "save_toast" in st.session_state:
+            st.toast(st.session_state.pop("save_toast"), icon="💰")
 
         # --- NEW: Quick Entry Buttons ---
         st.markdown("##### ⚡ Quick Fill (जल्दी भरने के लिए)")
@@ -435,24 +534,20 @@ if check_password():
             col_type, col_status = st.columns(2)
             with col_type:
                 # Transaction Type
-                t_type = st.selectbox("Type", ["Payment", "Contract/Deal", "Adjustment"], key="sb_t_type")               
+                st.selectbox("Type", TXN_TYPES, key="sb_t_type")               
             with col_type:
                 # Status Tag
-                t_status = st.selectbox("Status", ["N/A", "Work Started", "In Progress", "Completed"], key="sb_t_status")
+                st.selectbox("Status", TXN_STATUSES, key="sb_t_status")
             
             # एक रो में दो कॉलम्स बनाएँ
             col_date, col_amt = st.columns(2)
             with col_date:
-                t_date = st.date_input("Date", datetime.now(), key="sb_date")
+                st.date_input("Date", datetime.now(), key="sb_date")
             with col_amt:
                 amt = st.number_input("Amount (INR)", min_value=0.0, step=100.0, key="sb_amt")
             
             # Note field (will be pre-filled by quick buttons)
-            raw_note = st.text_input("Remark", key="sb_note")
-
-            # --- महत्वपूर्ण: टैग्स को नोट के साथ जोड़ना ---
-            # यह आपके पुराने DB स्ट्रक्चर को खराब नहीं करेगा
-            full_note = f"[{t_type}] | Status: {t_status} | {raw_note}"
+            st.text_input("Remark", key="sb_note")
 
             # --- VALIDATION ---
             is_valid = True
@@ -465,9 +560,6 @@ if check_password():
             if amt <= 0:
                 is_valid = False
 
-            # --- SAVE BUTTON ---
-            # यहाँ हम एक चालाकी करेंगे: 
-            # बटन दबाने से ठीक पहले 'sb_note' को 'full_note' से बदल देंगे ताकि डेटाबेस में टैग्स जाएँ
             # --- SAVE BUTTON WITH CALLBACK ---
             # यह कोड आपके पुराने 'if is_valid' वाले हिस्से की जगह लेगा
             st.button(
@@ -485,10 +577,17 @@ if check_password():
                     st.caption("⚠️ Source और Destination अकाउंट अलग-अलग होने चाहिए।")
             
             # बटन के बाद थोड़ा स्पेस
-            st.write("") 
-              
-        st.divider()
+            st.write("")
+
+        # अभी save हुई entry के दोनों accounts का नया balance - पूरा dashboard दोबारा चलाए बिना
+        last_saved = st.session_state.get("last_saved")
+        if last_saved:
+            acc_totals = get_account_totals()
+            st.caption("📒 " + " · ".join(f"{name}: ₹{get_bal(name, acc_totals):,.2f}" for name in last_saved))
 
+    @st.fragment
+    def add_party_form():
+        """Add New Party, with live duplicate suggestions"""
         # --- 1. CALLBACK FUNCTION (Must be at the top) ---
         def register_party_callback():
             """
@@ -505,23 +604,29 @@ if check_password():
                 st.session_state.form_error = "Please enter a name."
                 return
 
-            # Fetch existing names for duplicate check
+            # Duplicate Logic: trigram index से सिर्फ मिलते-जुलते नाम (पूरी directory नहीं)
             try:
-                existing_df = get_query("SELECT name FROM accounts")
-                existing_names = [str(n).strip().lower() for n in existing_df['name']] if existing_df is not None else []
-            except:
-                existing_names = []
-
-            # Duplicate Logic
-            is_duplicate = name.lower() in existing_names
-            matches = difflib.get_close_matches(name.lower(), existing_names, n=1, cutoff=0.8)
-
-            if (is_duplicate or matches) and not force:
-                st.session_state.form_warning = f"⚠️ Duplicate detected for '{name}'. Check 'Skip duplicate check' to proceed."
+                matches = find_similar_parties(name, limit=1, cutoff=0.8)
+            except sqlite3.OperationalError as e:
+                # Index न पढ़ा जा सके तो "कोई duplicate नहीं" मत मानो - user को बताओ
+                if not force:
+                    st.session_state.form_warning = (
+                        f"⚠️ Duplicate check failed (party name index: {e}). "
+                        "Check 'Skip duplicate check' to proceed."
+                    )
+                    return
+                matches = []
+
+            if matches and not force:
+                match_name, match_score = matches[0]
+                st.session_state.form_warning = (
+                    f"⚠️ Duplicate detected for '{name}' (matches '{match_name}', {match_score:.0%}). "
+                    "Check 'Skip duplicate check' to proceed."
+                )
             else:
                 try:
                     # Database Action
-                    run_action("INSERT INTO accounts (name, phone, address) VALUES (?, ?, ?)", (name, phone, addr))
+                    run_action("INSERT INTO accounts (name, phone, address, group_type) VALUES (?, ?, ?, 'Party')", (name, phone, addr))
                     
                     # CLEAR INPUTS SAFELY
                     st.session_state.input_name = ""
@@ -550,9 +655,20 @@ if check_password():
                 st.success(st.session_state.form_success)
                 st.session_state.form_success = "" # Clear after showing once
 
+            # Name stays outside the form so it reruns on Enter and can show live suggestions
+            st.text_input("1️⃣ Party Name", placeholder="e.g., Rahul Kumar", key="input_name")
+            typed_name = st.session_state.get("input_name", "").strip()
+            if len(typed_name) >= 3:
+                try:
+                    suggestions = find_similar_parties(typed_name, limit=3, cutoff=0.6)
+                except sqlite3.OperationalError as e:
+                    st.warning(f"⚠️ Party name index पढ़ा नहीं जा सका: {e}")
+                    suggestions = []
+                if suggestions:
+                    st.caption("🔎 Did you mean: " + ", ".join(f"**{n}** ({score:.0%})" for n, score in suggestions))
+
             # --- 3. THE FORM (Using the on_click callback) ---
             with st.form("party_form"):
-                st.text_input("1️⃣ Party Name", placeholder="e.g., Rahul Kumar", key="input_name")
                 st.text_input("2️⃣ Phone Number", placeholder="e.g., 9876543210", key="input_phone")
                 st.text_area("3️⃣ Full Address", placeholder="Location details...", height=100, key="input_addr")
                 st.checkbox("Skip duplicate check", key="force_check")
@@ -561,8 +677,10 @@ if check_password():
                 st.form_submit_button("➕ Register New Party", 
                                     on_click=register_party_callback, 
                                     use_container_width=True)
-                
-                                                            
+
+    @st.fragment
+    def party_directory():
+        """Master list, CSV / PDF export, edit and delete"""
         # --- PARTY DIRECTORY SECTION ---
         with st.expander("View, Edit, Delete or Download Parties 📋", expanded=False):
             st.subheader("Master List")
@@ -579,18 +697,7 @@ if check_password():
                     # Filter to toggle between seeing only Active or All parties
                     filter_status = st.selectbox("Show Status", ["Active Only", "All Records"])
 
-                view_df = directory_df.copy()
-
-                # Filter 1: By Status (Active vs Hidden)
-                if filter_status == "Active Only":
-                    view_df = view_df[view_df['is_active'] == 1]
-
-                # Filter 2: By Search Query
-                if search_query:
-                    view_df = view_df[
-                        view_df['name'].str.contains(search_query, case=False, na=False) |
-                        view_df['phone'].str.contains(search_query, case=False, na=False)
-                    ]
+                view_df = filter_directory(directory_df, filter_status, search_query)
 
                 # --- VISUAL FIX: Replace 1/0 with Emojis for the Table ---
                 # We create a display version so the underlying data stays clean for CSV/PDF
@@ -623,20 +730,25 @@ if check_password():
                     )
 
                 with col_pdf:
-                    # Logic to generate and provide the PDF
-                    pdf_bytes = generate_directory_pdf(view_df)
-                    if pdf_bytes:
-                        st.download_button(
-                            label="📑 Download PDF",
-                            data=pdf_bytes,
-                            file_name="party_directory.pdf",
-                            mime="application/pdf",
-                            use_container_width=True,
-                            key="dir_pdf_download" # Unique key is important
-                        )
-                        
-                    else:
-                        st.error("Failed to build PDF. Ensure no unusual symbols are in the text.")
+                    # PDF सिर्फ क्लिक पर बनता है; उसी filter/search/data पर दोबारा माँगने पर cache से आता है
+                    pdf_args = (filter_status, search_query, get_ledger_version())
+                    if st.session_state.get("dir_pdf_args") != pdf_args:
+                        if st.button("📑 Prepare PDF", use_container_width=True, key="dir_pdf_prepare"):
+                            st.session_state["dir_pdf_args"] = pdf_args
+
+                    if st.session_state.get("dir_pdf_args") == pdf_args:
+                        pdf_bytes = build_directory_pdf(*pdf_args)
+                        if pdf_bytes:
+                            st.download_button(
+                                label="📑 Download PDF",
+                                data=pdf_bytes,
+                                file_name="party_directory.pdf",
+                                mime="application/pdf",
+                                use_container_width=True,
+                                key="dir_pdf_download" # Unique key is important
+                            )
+                        else:
+                            st.error("Failed to build PDF. Ensure no unusual symbols are in the text.")
                        
                 st.divider()
 
@@ -644,7 +756,7 @@ if check_password():
                 st.subheader("✏️ Edit Party Details")
 
                 # 1. Fetch ALL records for the editor
-                full_directory_df = get_query("SELECT id, name, phone, address, is_active FROM accounts")
+                full_directory_df = get_query("SELECT id, name, phone, address, is_active, version FROM accounts")
 
                 # 2. Add a filter specifically for the Edit dropdown
                 edit_view_filter = st.radio(
@@ -677,7 +789,13 @@ if check_password():
                 if selected_party_label != "-- Choose --":
                     # Extract ID from the label
                     selected_id = int(selected_party_label.split("ID: ")[1])
-                    current_person = full_directory_df[full_directory_df['id'] == selected_id].iloc[0]
+                    # Optimistic locking: form पहली बार पढ़ी गई row (और उसके version) पर टिका रहता है
+                    current_person = st.session_state.get('party_snapshot')
+                    if current_person is None or current_person['id'] != selected_id:
+                        current_person = full_directory_df[full_directory_df['id'] == selected_id].iloc[0].to_dict()
+                        st.session_state['party_snapshot'] = current_person
+                    if st.session_state.pop('party_conflict', None) == selected_id:
+                        st.warning("⚠️ यह party किसी और ने अभी बदल दी - नीचे ताज़ा details हैं, दोबारा देख कर save करें।")
     
                     with st.form("edit_form"):
                         val_name = current_person['name'] if current_person['name'] else ""
@@ -702,12 +820,16 @@ if check_password():
                             status_val = 1 if is_active else 0
 
                             try:
-                                run_action(
-                                    "UPDATE accounts SET name=?, phone=?, address=?, is_active=? WHERE id=?",
-                                    (clean_name, clean_phone, clean_addr, status_val, selected_id)
-                                )
+                                update_account(selected_id, clean_name, clean_phone, clean_addr, status_val,
+                                               version=current_person['version'])
+                                st.session_state['party_snapshot'] = None
                                 st.success(f"✅ Changes for '{clean_name}' saved!")
-                                st.rerun()
+                                rerun_fragment()
+                            except EditConflict:
+                                # सिर्फ इसी party की row दोबारा पढ़ो
+                                st.session_state['party_snapshot'] = None
+                                st.session_state['party_conflict'] = selected_id
+                                rerun_fragment()
                             except Exception as e:
                                 st.error(f"🚫 Error updating: {e}")
 
@@ -718,8 +840,8 @@ if check_password():
                         if st.button(f"Confirm Permanent Delete: {current_person['name']}", type="primary", use_container_width=True):
                             # SAFETY CHECK: Check if transactions exist
                             check_trans = get_query(
-                                "SELECT COUNT(*) as total FROM transactions WHERE from_acc=? OR to_acc=?", 
-                                (current_person['name'], current_person['name'])
+                                "SELECT COUNT(*) as total FROM transactions WHERE from_id=? OR to_id=?", 
+                                (selected_id, selected_id)
                             )
                             
                             if check_trans['total'][0] > 0:
@@ -727,20 +849,39 @@ if check_password():
                             else:
                                 run_action("DELETE FROM accounts WHERE id=?", (selected_id,))
                                 st.success("Record deleted permanently.")
-                                st.rerun()
+                                rerun_fragment()
                                 
             else:
                 st.info("No parties registered yet.")
-                                               
+
+    with st.sidebar:
+        # GUIDELINE BOX FOR USER
+        st.info("""**📖 JGMPS**
+        - **Quick Guide:**
+        - **Sales:** Paid By: `Sales Income` → Received By: `Cash/Bank`
+        - **Expense:** Paid By: `Cash/Bank` → Received By: `Personal Expense`
+        - **Deposit:** Paid By: `Cash` → Received By: `Bank`""")
+                
+        st.header("➕ Add New Transaction")
+        entry_form()
+        st.divider()
+        add_party_form()
+        party_directory()
+
         # --- MAIN AREA: TABS (Updated with Books) ---
     tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📜 Recent History", "📖 Books", "📖 Trial Balance", "🔍 Advanced Search", "📖 Opening Balance", "📂 Export & Tools"])
-    with tab1:
+
+    # हर tab अपना fragment है और अपना data खुद पढ़ता है (LedgerCache snapshot सस्ता है: सिर्फ journal seq check)
+    @st.fragment
+    def history_tab():
+        """Full Transaction History"""
+        _, trans_df = get_ledger_cache().snapshot()
         st.subheader("Full Transaction History")
         if trans_df.empty:
             st.info("No transactions found yet. Start by adding one!")
         else:
             # 1. Reverse the data so newest is on top
-            full_history = trans_df.iloc[::-1].copy()
+            full_history = trans_df.drop(columns=['from_id', 'to_id']).iloc[::-1]
             
             # 2. Define a function to color the rows
             # This highlights 'Personal Expense' in light red
@@ -752,6 +893,7 @@ if check_password():
             # We use .style to make it look professional
             st.dataframe(
                 full_history.style.apply(highlight_expenses, axis=1), 
+                column_config=DATE_COLUMN_CONFIG,
                 use_container_width=True,
                 height=400 # Adds a scrollbar after this height
             )
@@ -759,7 +901,13 @@ if check_password():
             st.caption("💡 Red rows indicate Personal Expenses")
             st.caption("Courtesy of Jan Gan Man Public School Muradnagar")
 
-    with tab2:
+    with tab1:
+        history_tab()
+
+    @st.fragment
+    def books_tab():
+            """Account statement (Books) with edit / delete, WhatsApp and print view"""
+            acc_df, trans_df = get_ledger_cache().snapshot()
             st.subheader("📖 Account Statements (Books)")
             show_inactive = st.checkbox("Show Inactive Books", value=False, key="toggle_inactive")
             
@@ -778,14 +926,14 @@ if check_password():
                 start_date = st.date_input("From", datetime(2026, 1, 1), key="book_start")
             with col_s3:
                 end_date = st.date_input("To", datetime.now(), key="book_end")
+            col_f1, col_f2 = st.columns(2)
+            with col_f1:
+                book_types = st.multiselect("Type", TXN_TYPES, key="book_types")
+            with col_f2:
+                book_statuses = st.multiselect("Status", TXN_STATUSES, key="book_statuses")
             
-            # 2. FILTER DATA BY PARTY AND DATE RANGE
-            book_df = trans_df[(trans_df['from_acc'] == selected_book) | (trans_df['to_acc'] == selected_book)].copy()
-            book_df['date'] = pd.to_datetime(book_df['date']).dt.date
-            
-            # Apply the date filter
-            mask = (book_df['date'] >= start_date) & (book_df['date'] <= end_date)
-            filtered_df = book_df.loc[mask]
+            # 2. FETCH ONLY THIS BOOK'S DATE WINDOW FROM SQLITE (indexed, already sorted by date + id)
+            filtered_df = get_statement(selected_book, start_date, end_date)
             
             # ---- FINANCIAL YEAR SELECTION (TEMP FIX) ----
             selected_year = "2025-26"   # बाद में dropdown से आएगा
@@ -793,17 +941,8 @@ if check_password():
             # ---- FETCH OPENING BALANCE FROM TABLE ----
             opening = get_opening_balance(selected_book, selected_year)
 
-            # ---- CALCULATE PREVIOUS TRANSACTIONS BEFORE START DATE ----
-            previous_df = book_df[book_df['date'] < start_date]
-
-            prev_balance = 0.0
-            for _, row in previous_df.iterrows():
-                if row["to_acc"] == selected_book:
-                    prev_balance += row["amount"]
-                else:
-                    prev_balance -= row["amount"]
-
-            running_balance = opening + prev_balance
+            # ---- BALANCE OF TRANSACTIONS BEFORE START DATE (single SUM(CASE ...) query) ----
+            prev_balance = get_carried_forward(selected_book, start_date)
 
             st.success(f"Opening Balance ({selected_year}) : ₹{opening:,.2f}")
                         
@@ -811,66 +950,18 @@ if check_password():
                 st.write(f"Statement for **{selected_book}** from {fmt_date(start_date)} to {fmt_date(end_date)}")
                 # st.dataframe(filtered_df, use_container_width=True)
                 
-                # Sort properly by date + id to maintain order
-                filtered_df_sorted = filtered_df.sort_values(by=["date", "id"])
-
-                # ---- CALCULATE BALANCE BEFORE START DATE (PREVIOUS YEAR / PERIOD) ----
-                previous_df = book_df[book_df['date'] < start_date]
-                prev_balance = 0.0
-                #running_balance = 0.0
-                selected_year = "2025-26"   # अभी fix, बाद में dropdown
-
-                opening = get_opening_balance(selected_book, selected_year)
-                running_balance = opening + prev_balance
-
-                st.success(f"Opening Balance ({selected_year}) : ₹{opening:,.2f}")
-                    
-                ledger_rows = []
-
-                # ---- ADD OPENING BALANCE ROW ----
+                # ---- LEDGER WITH OPENING ROW + RUNNING BALANCE (vectorized) ----
                 opening_total = opening + prev_balance
+                ledger_report = build_ledger(selected_book, filtered_df, opening_total, start_date)
 
-                ledger_rows.append({
-                    "Date": start_date,
-                    "Particular": "Opening Balance",
-                    "Debit": opening_total if opening_total > 0 else 0.0,
-                    "Credit": abs(opening_total) if opening_total < 0 else 0.0,
-                    "Balance": opening_total,
-                    "Note": "Balance brought forward",
-                    "ID": ""
-                })
-                                                  
-                for _, row in previous_df.iterrows():
-                    if row["to_acc"] == selected_book:
-                        prev_balance += row["amount"]
-                    else:
-                        prev_balance -= row["amount"]
-                                
-                for _, row in filtered_df_sorted.iterrows():
-                    if row["to_acc"] == selected_book:
-                        # Debit
-                        debit = row["amount"]
-                        credit = 0.0
-                        running_balance += debit
-                        particular = f"From {row['from_acc']}"
-                    else:
-                        # Credit
-                        debit = 0.0
-                        credit = row["amount"]
-                        running_balance -= credit
-                        particular = f"To {row['to_acc']}"
-
-                    ledger_rows.append({
-                        "Date": row["date"],
-                        "Particular": particular,
-                        "Debit": debit,
-                        "Credit": credit,
-                        "Balance": running_balance,
-                        "Note": row["note"],
-                        "ID": row["id"]   # keep ID for edit/delete reference
-                    })
-
-                ledger_report = pd.DataFrame(ledger_rows)
+                # Type/Status filter सिर्फ दिखने वाली rows पर; running balance सारी entries का रहता है
+                if book_types or book_statuses:
+                    keep = pd.Series(True, index=filtered_df.index)
+                    if book_types:
+                        keep &= filtered_df['txn_type'].isin(book_types)
+                    if book_statuses:
+                        keep &= filtered_df['status'].isin(book_statuses)
+                    ledger_report = ledger_report[[True] + keep.tolist()]
 
                 # ---- COLOR BALANCE RED / GREEN ----
                 styled_ledger = ledger_report.style.applymap(
@@ -884,6 +975,8 @@ if check_password():
                     column_config={
                         "Date": st.column_config.TextColumn("Date", width="small"),
                         "Particular": st.column_config.TextColumn("Particular", width="medium"),
+                        "Type": st.column_config.TextColumn("Type", width="small"),
+                        "Status": st.column_config.TextColumn("Status", width="small"),
                         "Debit": st.column_config.NumberColumn("Debit", format="%.2f"),
                         "Credit": st.column_config.NumberColumn("Credit", format="%.2f"),
                         "Balance": st.column_config.NumberColumn("Balance", format="%.2f"),
@@ -926,6 +1019,7 @@ if check_password():
                 if st.session_state.get('should_reset', False):
                     st.session_state['action_id_input'] = 0
                     st.session_state['should_reset'] = False 
+                    st.session_state['edit_snapshot'] = None
 
                 action_col1, action_col2 = st.columns(2)
 
@@ -941,7 +1035,24 @@ if check_password():
                     # Fetch the specific record
                     target_row = filtered_df[filtered_df['id'] == edit_id] if not filtered_df.empty else pd.DataFrame()
 
-                    if not target_row.empty:
+                    # Optimistic locking: form उसी row + version पर टिका रहता है जो पहली बार पढ़ा था;
+                    # Save/Delete तभी होगा जब बीच में किसी और ने यह entry न बदली हो
+                    snapshot = st.session_state.get('edit_snapshot')
+                    if not target_row.empty and (snapshot is None or snapshot['id'] != edit_id):
+                        snapshot = get_transaction(edit_id)
+                        st.session_state['edit_snapshot'] = snapshot
+
+                    if st.session_state.pop('edit_conflict', None) == edit_id:
+                        st.warning("⚠️ यह entry किसी और ने अभी बदल दी - नीचे उसकी ताज़ा values हैं, दोबारा देख कर save करें।")
+
+                    def refresh_snapshot():
+                        """Conflict: सिर्फ इसी row को DB से दोबारा पढ़ो और form फिर से दिखाओ"""
+                        st.session_state['edit_snapshot'] = get_transaction(edit_id)
+                        st.session_state['edit_conflict'] = edit_id
+                        st.session_state['confirm_delete'] = False
+                        rerun_fragment()
+
+                    if not target_row.empty and snapshot is not None:
                         col_btn1, col_btn2 = st.columns(2)
                         
                         # 1. DELETE LOGIC WITH CONFIRMATION
@@ -953,11 +1064,14 @@ if check_password():
                                 st.write(f"Are you sure you want to permanently delete Record ID: {edit_id}?")
                                 c1, c2 = st.columns(2)
                                 if c1.button("✅ Yes, Delete", type="primary", use_container_width=True):
-                                    run_action("DELETE FROM transactions WHERE id=?", (int(edit_id),))
+                                    try:
+                                        delete_transaction(edit_id, snapshot['version'])
+                                    except EditConflict:
+                                        refresh_snapshot()
                                     st.session_state['confirm_delete'] = False
                                     st.session_state['should_reset'] = True  # Signal reset
                                     st.success(f"Record {edit_id} deleted.")
-                                    st.rerun()
+                                    rerun_fragment()
                                 
                                 # Use the callback for the 'No' button
                                 c2.button("❌ No, Keep it", use_container_width=True, on_click=trigger_reset)
@@ -965,11 +1079,16 @@ if check_password():
                         # 2. EDIT LOGIC (Expandable Form)
                         with st.expander("📝 Edit Details", expanded=True):
                             # Store original values for comparison
-                            orig_date = pd.to_datetime(target_row['date'].values[0]).date()
-                            orig_from = target_row['from_acc'].values[0]
-                            orig_to = target_row['to_acc'].values[0]
-                            orig_amt = float(target_row['amount'].values[0])
-                            orig_note = target_row['note'].values[0]
+                            orig_date = snapshot['date'].date()
+                            orig_from = snapshot['from_acc']
+                            orig_to = snapshot['to_acc']
+                            orig_amt = float(snapshot['amount'])
+                            orig_note = snapshot['note']
+                            orig_type = snapshot['txn_type']
+                            orig_status = snapshot['status']
+                            # पुरानी entries में type/status खाली हो सकते हैं
+                            type_opts = TXN_TYPES if orig_type in TXN_TYPES else [orig_type] + TXN_TYPES
+                            status_opts = TXN_STATUSES if orig_status in TXN_STATUSES else [orig_status] + TXN_STATUSES
 
                             # Widgets
                             new_date = st.date_input("New Date", value=orig_date)
@@ -977,21 +1096,29 @@ if check_password():
                             new_to = st.selectbox("New Received By", all_accs, index=all_accs.index(orig_to))
                             new_amt = st.number_input("New Amount", value=orig_amt)
                             new_note = st.text_input("New Remark", value=orig_note)
+                            new_type = st.selectbox("New Type", type_opts, index=type_opts.index(orig_type),
+                                                    format_func=lambda v: v or "—")
+                            new_status = st.selectbox("New Status", status_opts, index=status_opts.index(orig_status),
+                                                      format_func=lambda v: v or "—")
 
                             # Change Detection
                             has_changed = (
                                 new_date != orig_date or new_from != orig_from or 
-                                new_to != orig_to or new_amt != orig_amt or new_note != orig_note
+                                new_to != orig_to or new_amt != orig_amt or new_note != orig_note or
+                                new_type != orig_type or new_status != orig_status
                             )
 
                             eb1, eb2 = st.columns(2)
                             with eb1:
                                 if st.button("💾 Save Changes", type="primary", use_container_width=True, disabled=not has_changed):
-                                    run_action("""UPDATE transactions SET date=?, from_acc=?, to_acc=?, amount=?, note=? WHERE id=?""", 
-                                            (new_date.strftime("%Y-%m-%d"), new_from, new_to, new_amt, new_note, int(edit_id)))
+                                    try:
+                                        update_transaction(edit_id, new_date, new_from, new_to, new_amt, new_note,
+                                                           new_type, new_status, version=snapshot['version'])
+                                    except EditConflict:
+                                        refresh_snapshot()
                                     st.session_state['should_reset'] = True  # Signal reset
                                     st.success("Record Updated!")
-                                    st.rerun()
+                                    rerun_fragment()
                             
                             with eb2:
                                 # Use the callback to avoid "instantiated" error
@@ -1072,6 +1199,7 @@ if check_password():
                         
                         # Transaction Table (using st.table for better print formatting)
                         report_display = filtered_df[['date', 'from_acc', 'to_acc', 'amount', 'note']].copy()
+                        report_display['date'] = report_display['date'].dt.date
                         st.table(report_display)
                         
                         # ---- AFTER st.table(report_display) ----
@@ -1106,35 +1234,34 @@ if check_password():
 
                         if st.button("❌ Close Print View"):
                             st.session_state['show_party_report'] = False
-                            st.rerun()
+                            rerun_fragment()
                     
             else:
                 st.warning(f"No transactions found for {selected_book} between {fmt_date(start_date)} and {fmt_date(end_date)}.")
 
-    with tab3: 
+    with tab2:
+        books_tab()
+
+    @st.fragment
+    def trial_balance_tab():
+        """Trial Balance as of a date"""
         st.subheader("⚖️ Trial Balance")
 
-        if not trans_df.empty:
-            # 1. Calculate Net Balances
-            all_accounts = pd.concat([trans_df['from_acc'], trans_df['to_acc']]).unique()
-            balance_data = []
-            
-            for acc in sorted(all_accounts):
-                total_out = trans_df[trans_df['from_acc'] == acc]['amount'].sum()
-                total_in = trans_df[trans_df['to_acc'] == acc]['amount'].sum()
-                open_bal = get_opening_balance(acc, current_fin_year())
-
-                net = open_bal + total_in - total_out
-
-                balance_data.append({
-                    "Account Name": acc,
-                    "Opening": open_bal,
-                    "Total In": total_in,
-                    "Total Out": total_out,
-                    "Net Balance": net
-                })
-            
-            trial_report = pd.DataFrame(balance_data)
+        tb_col1, tb_col2 = st.columns(2)
+        with tb_col1:
+            tb_fy = st.selectbox(
+                "Opening Balances of Financial Year",
+                FIN_YEARS,
+                index=FIN_YEARS.index(current_fin_year()) if current_fin_year() in FIN_YEARS else 0,
+                key="tb_fin_year"
+            )
+        with tb_col2:
+            tb_as_of = st.date_input("As of Date (optional)", value=None, key="tb_as_of")
+
+        # 1. Calculate Net Balances: one grouped query + one bulk opening-balance fetch
+        trial_report = trial_balance(tb_fy, tb_as_of)
+
+        if not trial_report.empty:
 
             # 2. Professional Display (Alignment is automatic for NumberColumn)
  
@@ -1171,9 +1298,11 @@ if check_password():
             # 3. Summary Totals aligned with table columns
             c1, c2, c3, c4 = st.columns([3, 2, 2, 2])  # same visual proportion as table
 
-            total_in_sum = trial_report["Total In"].sum()
-            total_out_sum = trial_report["Total Out"].sum()
-            difference = trial_report["Net Balance"].sum()
+            # Paise में जोड़ो: exact, इसलिए balance check सीधी बराबरी है
+            total_in_sum = to_rupees(to_paise(trial_report["Total In"]).sum())
+            total_out_sum = to_rupees(to_paise(trial_report["Total Out"]).sum())
+            difference_paise = to_paise(trial_report["Net Balance"]).sum()
+            difference = to_rupees(difference_paise)
 
             # Leave Account Name column empty
             with c1:
@@ -1186,7 +1315,7 @@ if check_password():
                 st.metric("Total Outflow", f"{total_out_sum:,.2f}")
 
             with c4:  
-                if abs(difference) < 0.01:
+                if difference_paise == 0:
                     st.metric("System Difference", "0.00", delta="Balanced", delta_color="normal")
                     st.success("✅ System Balanced")
                 else:
@@ -1194,35 +1323,74 @@ if check_password():
 
         else:
             st.info("No transactions available.")
-        
-    with tab4:
+
+    with tab3:
+        trial_balance_tab()
+
+    @st.fragment
+    def search_tab():
+        """Full-text search with filters and delete"""
         st.subheader("Search your Ledger")
-        search = st.text_input("Type name or note to filter...", key="main_search_input")
-        if search:
-            # Safer and faster way to search across all columns
-            search_query = search.lower()
-            filt = trans_df[trans_df.apply(lambda row: row.astype(str).str.contains(search_query, case=False).any(), axis=1)]
-            st.write(f"Found {len(filt)} matching records:")
-            st.dataframe(filt, use_container_width=True)
+        search = st.text_input("Type name, note, amount or date to search...", key="main_search_input")
+
+        with st.expander("🔧 Filters (Date / Amount / Type / Status)", expanded=False):
+            sf1, sf2, sf3, sf4 = st.columns(4)
+            s_from = sf1.date_input("From Date", value=None, key="search_from")
+            s_to = sf2.date_input("To Date", value=None, key="search_to")
+            s_min = sf3.number_input("Min Amount", min_value=0.0, value=None, step=100.0, key="search_min")
+            s_max = sf4.number_input("Max Amount", min_value=0.0, value=None, step=100.0, key="search_max")
+            sf5, sf6 = st.columns(2)
+            s_types = sf5.multiselect("Type", TXN_TYPES, key="search_types")
+            s_statuses = sf6.multiselect("Status", TXN_STATUSES, key="search_statuses")
+
+        # पिछली run में user को दिखी rows के versions: delete उसी version पर होगा जो user ने देखा था
+        seen_versions = st.session_state.get("search_seen_versions", {})
+
+        has_filter = any(v is not None for v in (s_from, s_to, s_min, s_max)) or bool(s_types or s_statuses)
+        if search or has_filter:
+            # FTS5 index से ranked, paginated results (हर शब्द prefix की तरह match होता है)
+            page_size = 50
+            page_no = st.number_input("Page", min_value=1, step=1, key="search_page")
+            filt, total_found = search_transactions(
+                search, limit=page_size, offset=(page_no - 1) * page_size,
+                date_from=s_from, date_to=s_to, min_amount=s_min, max_amount=s_max,
+                txn_types=s_types, statuses=s_statuses
+            )
+            total_pages = max(1, -(-total_found // page_size))
+            st.write(f"Found {total_found} matching records (page {page_no} of {total_pages}):")
+            st.dataframe(filt.drop(columns="version"), column_config=DATE_COLUMN_CONFIG, use_container_width=True)
+            st.session_state["search_seen_versions"] = dict(zip(filt['id'].tolist(), filt['version'].tolist()))
             
             if not filt.empty:
                 del_id = st.number_input("Enter ID to Delete", min_value=0, step=1, key="delete_id_input")
                 if st.button("🗑️ Permanently Delete ID", key="delete_confirm_btn"):
-                    run_action("DELETE FROM transactions WHERE id=?", (del_id,))
-                    st.warning(f"Deleted transaction {del_id}")
-                    st.rerun()
+                    if del_id not in seen_versions:
+                        st.error(f"ID {del_id} इन search results में नहीं है।")
+                    else:
+                        try:
+                            delete_transaction(del_id, seen_versions[del_id])
+                        except EditConflict:
+                            st.warning(f"⚠️ ID {del_id} को किसी और ने अभी बदला या delete किया है - results दोबारा देखें, फिर delete करें।")
+                        else:
+                            st.warning(f"Deleted transaction {del_id}")
+                            rerun_fragment()
 
+    with tab4:
+        search_tab()
 
-    with tab5:
+    @st.fragment
+    def opening_balance_tab():
+        """Opening Balances, financial year wise"""
+        acc_df, _ = get_ledger_cache().snapshot()
         st.subheader("📂 Opening Balances (Financial Year Wise)")
 
         # --- SELECT FINANCIAL YEAR ---
         fy_default = current_fin_year()
         fy = st.selectbox(
             "Select Financial Year",
-            ["2023-24", "2024-25", "2025-26", "2026-27"],
-            index=["2023-24", "2024-25", "2025-26", "2026-27"].index(fy_default)
-            if fy_default in ["2023-24", "2024-25", "2025-26", "2026-27"] else 0
+            FIN_YEARS,
+            index=FIN_YEARS.index(fy_default)
+            if fy_default in FIN_YEARS else 0
         )
 
         st.divider()
@@ -1246,53 +1414,52 @@ if check_password():
 
         # --- SAVE / UPDATE LOGIC ---
         if save_btn:
-            with sqlite3.connect("business_ledger.db") as conn:
-                cur = conn.cursor()
-
-                # Check if already exists for this year & account
-                cur.execute("""
-                    SELECT id FROM opening_balances 
-                    WHERE account_name=? AND financial_year=?
-                """, (sel_acc, fy))
-                row = cur.fetchone()
-
-                if row:
-                    # Update existing
-                    cur.execute("""
-                        UPDATE opening_balances 
-                        SET balance=?, type=?
-                        WHERE account_name=? AND financial_year=?
-                    """, (ob_amount, ob_type, sel_acc, fy))
-                    st.success(f"Opening Balance Updated for {sel_acc} ({fy})")
-                else:
-                    # Insert new
-                    cur.execute("""
-                        INSERT INTO opening_balances (account_name, balance, type, financial_year)
+            def save_opening(conn):
+                # इस year और account की entry पहले से हो तो update, वरना insert
+                sel_acc_id = conn.execute("SELECT id FROM accounts WHERE name=?", (sel_acc,)).fetchone()[0]
+                updated = conn.execute("""
+                    UPDATE opening_balances 
+                    SET balance=?, type=?
+                    WHERE account_id=? AND financial_year=?
+                """, (to_paise(ob_amount), ob_type, sel_acc_id, fy)).rowcount
+                if not updated:
+                    conn.execute("""
+                        INSERT INTO opening_balances (account_id, balance, type, financial_year)
                         VALUES (?, ?, ?, ?)
-                    """, (sel_acc, ob_amount, ob_type, fy))
-                    st.success(f"Opening Balance Saved for {sel_acc} ({fy})")
+                    """, (sel_acc_id, to_paise(ob_amount), ob_type, fy))
+                return updated
 
-                conn.commit()
+            if write(save_opening):
+                st.success(f"Opening Balance Updated for {sel_acc} ({fy})")
+            else:
+                st.success(f"Opening Balance Saved for {sel_acc} ({fy})")
 
         st.divider()
 
         # --- DISPLAY CURRENT OPENING BALANCES ---
         st.markdown("### 📊 Opening Balances List")
 
-        with sqlite3.connect("business_ledger.db") as conn:
-            ob_df = pd.read_sql_query("""
-                SELECT account_name, balance, type, financial_year 
-                FROM opening_balances
-                ORDER BY financial_year, account_name
-            """, conn)
+        with connection() as conn:
+            ob_df = rupees_frame(pd.read_sql_query("""
+                SELECT a.name AS account_name, ob.balance, ob.type, ob.financial_year 
+                FROM opening_balances ob
+                JOIN accounts a ON a.id = ob.account_id
+                ORDER BY ob.financial_year, a.name
+            """, conn))
 
         if not ob_df.empty:
             st.dataframe(ob_df, use_container_width=True, hide_index=True)
         else:
             st.info("No opening balances entered yet.")
 
+    with tab5:
+        opening_balance_tab()
 
-    with tab6:
+    @st.fragment
+    def tools_tab():
+        """Reports, exports, backup / restore and maintenance"""
+        acc_df, trans_df = get_ledger_cache().snapshot()
+        _, _, sales, expenses, profit, margin_pct = business_summary()
  
         st.subheader("📑 Financial Reports & Export")
         
@@ -1327,12 +1494,13 @@ if check_password():
         col_ex1, col_ex2 = st.columns(2)
         
         with col_ex1:
-            csv = trans_df.to_csv(index=False).encode('utf-8')
+            # File सिर्फ download click पर बनती है (SQLite से batches में, temp file के रास्ते)
+            gzip_csv = st.checkbox("Compress (.csv.gz)", key="export_gzip")
             st.download_button(
                 "📥 Export Full Ledger (CSV)", 
-                csv, 
-                f"Ledger_Backup_{datetime.now().strftime('%Y-%m-%d')}.csv", 
-                "text/csv", 
+                data=lambda: ledger_csv_bytes(gzip_csv),
+                file_name=f"Ledger_Backup_{datetime.now().strftime('%Y-%m-%d')}.csv" + (".gz" if gzip_csv else ""),
+                mime="application/gzip" if gzip_csv else "text/csv",
                 use_container_width=True
             )
             
@@ -1342,6 +1510,30 @@ if check_password():
                 st.info("Generating Report... Scroll down to see the Print View")
                 st.session_state['show_report'] = True
 
+        # --- EXCEL WORKBOOK: Trial Balance + चुनी हुई Books + Opening Balances + Directory ---
+        with st.expander("📗 Excel Workbook (multi-sheet)"):
+            xl_accounts = st.multiselect("Statements for", sorted(acc_df['name'].tolist()), key="xlsx_accounts")
+            xl_c1, xl_c2, xl_c3 = st.columns(3)
+            with xl_c1:
+                xl_start = st.date_input("From", datetime(2026, 1, 1), key="xlsx_start")
+            with xl_c2:
+                xl_end = st.date_input("To", datetime.now(), key="xlsx_end")
+            with xl_c3:
+                xl_fy = st.selectbox(
+                    "Opening Balances of",
+                    FIN_YEARS,
+                    index=FIN_YEARS.index(current_fin_year()) if current_fin_year() in FIN_YEARS else 0,
+                    key="xlsx_fin_year"
+                )
+            # Workbook सिर्फ download click पर बनती है
+            st.download_button(
+                "📥 Export Workbook (.xlsx)",
+                data=lambda: ledger_xlsx_bytes(xl_accounts, xl_start, xl_end, xl_fy),
+                file_name=f"Ledger_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
+
         # --- THE PRINTABLE REPORT VIEW ---
         if st.session_state.get('show_report', False):
             st.divider()
@@ -1363,68 +1555,170 @@ if check_password():
                 
                 st.write("### Summary of Recent Transactions")
                 # Show only the last 15 for a clean print
-                st.table(trans_df.tail(15)[['date', 'from_acc', 'to_acc', 'amount']])
+                recent = trans_df.tail(15)[['date', 'from_acc', 'to_acc', 'amount']]
+                st.table(recent.assign(date=recent['date'].dt.date))
                 
                 st.markdown("---")
                 st.caption("End of Report - MyLedger 2026 Management System")
                 
                 if st.button("Close Report"):
                     st.session_state['show_report'] = False
-                    st.rerun()
+                    rerun_fragment()
                         
         st.divider()
 
+        # --- BALANCE CONSISTENCY CHECK ---
+        st.subheader("♻️ Rebuild Account Balances")
+        st.caption("Recomputes the stored per-account totals from every transaction and reports any that had drifted.")
+        if st.button("♻️ Rebuild & Verify", key="rebuild_balances_btn"):
+            mismatched = rebuild_account_balances()
+            if mismatched:
+                st.warning(f"Fixed {len(mismatched)} account(s): {', '.join(map(str, mismatched))}")
+            else:
+                st.success("✅ All account balances were already consistent.")
+
+        # इस process का cold start: imports, schema bootstrap, पहली run (और PDF font, अगर बना)
+        st.caption(f"⏱️ Startup: {startup.report()}")
+        st.caption(
+            f"✍️ Writer: {writer.stats['writes']:,} writes in {writer.stats['batches']:,} commits"
+            f" · {writer.stats['retries']} busy retries"
+        )
+
+        st.divider()
+
         # बैकअप सेक्शन के लिए एक हेडिंग
         st.subheader("🛠️ डेटा सुरक्षा (Backup)")
 
-        # बैकअप फाइल को पढ़ने और बटन दिखाने का सीधा तरीका
-        try:
-            with open("business_ledger.db", "rb") as f:
+        # Snapshot SQLite backup API से बनता है (app चलते हुए भी consistent copy), compressed होकर backups/ में
+        bk_col1, bk_col2 = st.columns([1, 2])
+        with bk_col1:
+            bk_compression = st.radio("Compression", list(COMPRESSORS), horizontal=True, key="backup_compression")
+            if st.button("📸 New Snapshot", key="backup_create_btn", use_container_width=True):
+                with st.spinner("Backing up..."):
+                    create_backup(bk_compression)
+            # पिछले backup के बाद की सिर्फ बदली हुई rows (changes journal से) - कुछ KB की file
+            if st.button("➕ Incremental", key="backup_delta_btn", use_container_width=True):
+                try:
+                    if create_incremental_backup() is None:
+                        st.info("पिछले backup के बाद कोई बदलाव नहीं।")
+                except ValueError as e:
+                    st.warning(str(e))
+
+        # Main download हमेशा newest full snapshot; उसके बाद की deltas अलग-अलग, restore के क्रम में
+        latest = latest_full_backup()
+        with bk_col2:
+            if latest is None:
+                st.info("अभी कोई backup नहीं है। 'New Snapshot' दबाएँ।")
+            else:
+                deltas = deltas_after(latest)
+                st.caption(
+                    f"Full: {latest['file']} · {latest['bytes'] / 1024 / 1024:,.1f} MB "
+                    f"({latest['db_bytes'] / 1024 / 1024:,.1f} MB database) · sha256 {latest['sha256']}"
+                )
+                # File सिर्फ download click पर पढ़ी जाती है, हर rerun पर नहीं
                 st.download_button(
                     label="📥 Download Database Backup",
-                    data=f,
-                    file_name="ledger_backup.db",
+                    data=lambda: read_backup(latest),
+                    file_name=latest["file"],
                     mime="application/octet-stream",
+                    key=f"backup_dl_{latest['file']}",
                     help="अपने पूरे डेटाबेस की कॉपी सुरक्षित रखने के लिए यहाँ क्लिक करें"
                 )
-        except FileNotFoundError:
-            st.error("डेटाबेस फाइल नहीं मिली! कृपया पहले एक एंट्री करें।")
+                if deltas:
+                    st.caption(
+                        f"Restore के लिए यह full file और उसके बाद की सारी {len(deltas)} delta files चाहिए, "
+                        "इसी क्रम में (1 → आखिरी) - सब एक साथ upload करें।"
+                    )
+                    for n, delta in enumerate(deltas, start=1):
+                        st.caption(
+                            f"{n}. {delta['file']} · {delta['bytes'] / 1024:,.1f} KB · {delta['rows']:,} changed rows "
+                            f"(seq {delta['from_seq']} → {delta['seq']}) · sha256 {delta['sha256']}"
+                        )
+                        st.download_button(
+                            label=f"📥 Delta {n}",
+                            data=lambda delta=delta: read_backup(delta),
+                            file_name=delta["file"],
+                            mime="application/gzip",
+                            key=f"backup_dl_{delta['file']}",
+                        )
 
         st.divider()
 
         st.subheader("📤 बैकअप वापस डालें (Restore)")
 
-        # 1. फाइल अपलोडर
-        uploaded_file = st.file_uploader("अपनी बैकअप फाइल (.db) चुनें", type="db")
+        # 1. फाइल अपलोडर: एक full backup (.db / .db.gz / .db.xz) + चाहें तो उसके बाद की .delta.gz files
+        uploaded_files = st.file_uploader(
+            "अपनी बैकअप फाइल (.db / .db.gz / .db.xz) और delta files चुनें", type=["db", "gz", "xz"],
+            accept_multiple_files=True
+        )
 
-        if uploaded_file is not None:
-            # 2. सुरक्षा की पहली परत: पासवर्ड
-            restore_pwd = st.text_input("Security Password डालें", type="password", key="res_pwd")
-            
-            # 3. सुरक्षा की दूसरी परत: कन्फर्मेशन चेकबॉक्स
-            st.warning("⚠️ चेतावनी: डेटा रिस्टोर करने से आपका अभी का सारा हिसाब मिट जाएगा और पुरानी फाइल वाला डेटा लोड हो जाएगा।")
-            confirm_check = st.checkbox("हाँ, मैं समझता हूँ और डेटा ओवरराइट करना चाहता हूँ।")
-
-            # 4. बटन तभी काम करेगा जब दोनों शर्तें पूरी होंगी
-            if st.button("🔄 Start Restoration"):
-                if restore_pwd == "Admin@123": # अपना पासवर्ड यहाँ लिखें
-                    if confirm_check:
-                        with open("business_ledger.db", "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        
-                        st.success("✅ डेटा सफलतापूर्वक ओवरराइट कर दिया गया है!")
-                        if st.button("🔄 Refresh App Now"):
-                            st.rerun()
-                        st.balloons()
-                        # st.info("बदलाव देखने के लिए कृपया ब्राउज़र पेज को रिफ्रेश (Refresh) करें।")
+        # Upload एक बार temp file में उतारकर (deltas replay करके) जाँचा जाता है, हर rerun पर नहीं
+        upload_id = tuple(sorted(f.file_id for f in uploaded_files)) or None
+        if st.session_state.get("restore_upload_id") != upload_id:
+            stale = st.session_state.pop("restore_path", None)
+            if stale and os.path.exists(stale):
+                os.remove(stale)
+            st.session_state["restore_upload_id"] = upload_id
+            st.session_state["restore_preview"] = st.session_state["restore_error"] = None
+            if uploaded_files:
+                with st.spinner("Backup जाँचा जा रहा है..."):
+                    try:
+                        st.session_state["restore_path"] = spool_uploads(uploaded_files)
+                        # पुराने schema का backup यहीं (temp copy पर) upgrade होता है, live DB को छूने से पहले
+                        st.session_state["restore_preview"] = prepare_restore(
+                            st.session_state["restore_path"], migration_progress()
+                        )
+                    except ValueError as e:
+                        st.session_state["restore_error"] = str(e)
+
+        if uploaded_files:
+            if st.session_state["restore_error"]:
+                st.error(f"❌ यह फाइल restore नहीं की जा सकती: {st.session_state['restore_error']}")
+            elif st.session_state["restore_preview"] is None:
+                st.info("✅ यह फाइल restore हो चुकी है।")
+            else:
+                st.caption("✅ Integrity check पास। Restore के बाद rows:")
+                st.dataframe(pd.DataFrame(st.session_state["restore_preview"]), hide_index=True, use_container_width=True)
+
+                # 2. सुरक्षा की पहली परत: पासवर्ड
+                restore_pwd = st.text_input("Security Password डालें", type="password", key="res_pwd")
+
+                # 3. सुरक्षा की दूसरी परत: कन्फर्मेशन चेकबॉक्स
+                st.warning("⚠️ चेतावनी: डेटा रिस्टोर करने से आपका अभी का सारा हिसाब मिट जाएगा और पुरानी फाइल वाला डेटा लोड हो जाएगा।")
+                confirm_check = st.checkbox("हाँ, मैं समझता हूँ और डेटा ओवरराइट करना चाहता हूँ।")
+
+                # 4. बटन तभी काम करेगा जब दोनों शर्तें पूरी होंगी
+                if st.button("🔄 Start Restoration"):
+                    if restore_pwd == "Admin@123": # अपना पासवर्ड यहाँ लिखें
+                        if confirm_check:
+                            with st.spinner("Restoring..."):
+                                restore_database(st.session_state.pop("restore_path"))
+                            # सारे in-process caches पुराने DB के हैं
+                            get_ledger_cache.clear()
+                            st.cache_data.clear()
+                            st.session_state["restore_preview"] = None
+
+                            st.success("✅ डेटा सफलतापूर्वक ओवरराइट कर दिया गया है!")
+                            if st.button("🔄 Refresh App Now"):
+                                st.rerun()
+                            st.balloons()
+                        else:
+                            st.error("❌ कृपया ऊपर दिए गए 'चेकबॉक्स' को टिक करके पुष्टि (Confirm) करें।")
                     else:
-                        st.error("❌ कृपया ऊपर दिए गए 'चेकबॉक्स' को टिक करके पुष्टि (Confirm) करें।")
-                else:
-                    st.error("❌ गलत पासवर्ड!")
+                        st.error("❌ गलत पासवर्ड!")
 
         st.divider()
 
         # लॉगआउट बटन
         if st.button("🚨 Log Out", key="logout_btn"):
             st.session_state["authenticated"] = False
-            st.rerun()
\ No newline at end of file
+            st.rerun()
+
+    with tab6:
+        tools_tab()
+
+
+# पहली पूरी run का समय (cold start → first paint), process में एक बार log होता है
+if "first run" not in startup.timings:
+    startup.timings["first run"] = (time.perf_counter() - _run_start) * 1000
+    print(f"Startup: {startup.report()}")
@@ -0,0 +1,35 @@
+import pandas as pd
+
+# DB में हर रकम INTEGER paise में है (₹1 = 100 paise) ताकि SUM हमेशा exact रहे;
+# UI, PDF और CSV rupees (float) में काम करते हैं। Conversion सिर्फ इन्हीं functions से।
+PAISE_PER_RUPEE = 100
+
+# Query results के वो columns जो paise में आते हैं
+MONEY_COLUMNS = ("amount", "balance", "total_in", "total_out", "opening")
+
+
+def to_paise(rupees):
+    """Rupees (number, Series or array) -> integer paise, rounded to the nearest paisa"""
+    if isinstance(rupees, (int, float)):
+        return int(round(rupees * PAISE_PER_RUPEE))
+    return (rupees * PAISE_PER_RUPEE).round().astype("int64")
+
+
+def to_rupees(paise):
+    """Integer paise (number, Series or array) -> rupees"""
+    return paise / PAISE_PER_RUPEE
+
+
+def rupees_frame(df):
+    """Convert the paise columns of a query result to rupees, in place; returns df"""
+    for col in MONEY_COLUMNS:
+        if col in df.columns:
+            df[col] = to_rupees(pd.to_numeric(df[col]))
+    return df
+
+
+def paise_str(paise):
+    """Integer paise -> exact '1234.50' text (CSV / Excel exports, no float rounding)"""
+    sign = "-" if paise < 0 else ""
+    rupees, rest = divmod(abs(int(paise)), PAISE_PER_RUPEE)
+    return f"{sign}{rupees}.{rest:02d}"
@@ -1,83 +1,805 @@
-import sqlite3
+import datetime
+import re
 
-def init_db():
+from db_pool import ConnectionPool, connection
+from write_queue import write, writer
+from ledger_engine import (
+    STATEMENT_SQL, CARRIED_FORWARD_SQL, TRIAL_TOTALS_SQL, TRIAL_TAIL_SQL, OPENING_BALANCE_SQL,
+    INFLOW_TRENDS_SQL, day_number
+)
+
+def _columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [col[1] for col in cursor.fetchall()]
+
+
+def _update(table, assignment, condition):
+    """Backfill for MIGRATIONS: UPDATE table SET assignment WHERE condition, id-range batch by batch"""
+    return (table, f"UPDATE {table} SET {assignment} WHERE id >= :start AND id < :end AND ({condition})")
+
+
+def _drop_derived(cursor):
+    """
+    transactions के triggers, indexes और उससे बनी tables हटाओ, किसी column के बदलने से पहले।
+
+    The later migrations (day column, journal, balances, daily totals,
+    indexes, search) create them again against the new columns and refill the
+    tables; meanwhile the backfills do not have to maintain them row by row.
+    """
+    cursor.execute("SELECT type, name FROM sqlite_master WHERE type IN ('trigger', 'index') AND tbl_name = 'transactions' AND sql IS NOT NULL")
+    for kind, name in cursor.fetchall():
+        cursor.execute(f"DROP {kind.upper()} {name}")
+    # Accounts पर है पर transactions.amount पढ़ता है
+    cursor.execute("DROP TRIGGER IF EXISTS fts_account_rename")
+    for table in ("account_balances", "daily_totals", "transactions_fts"):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def _base_tables(cursor):
+    """Migration 1: डेटाबेस और टेबल्स को इनिशियलाइज़ करें (नई DB सीधे नए schema पर बनती है)"""
+    # 1. Accounts Table (is_active के साथ)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            phone TEXT,
+            group_type TEXT,
+            address TEXT,
+            is_active INTEGER DEFAULT 1
+        )
+    ''')
+    # बहुत पुरानी DB में is_active / group_type नहीं थे; DEFAULT 1 से सब active रहते हैं
+    cursor.execute("PRAGMA table_info(accounts)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'is_active' not in columns:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN is_active INTEGER DEFAULT 1")
+    if 'group_type' not in columns:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN group_type TEXT")
+    
     # अगर यह जानकारी पहले से मौजूद है, तो इसे दोबारा मत डालो और चुपचाप आगे बढ़ जाओ
-    #"""डेटाबेस और टेबल्स को इनिशियलाइज़ करें, साथ ही डिफ़ॉल्ट खाते डालें।"""
-    with sqlite3.connect('business_ledger.db') as conn:
-        cursor = conn.cursor()
-        # अगर यह जानकारी पहले से मौजूद है, तो इसे दोबारा मत डालो और चुपचाप आगे बढ़ जाओ  
-        # 1. Accounts Table (is_active के साथ)
+    # 2. Transactions Table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, 
+            date TEXT, 
+            from_id INTEGER REFERENCES accounts (id), 
+            to_id INTEGER REFERENCES accounts (id), 
+            amount INTEGER,         -- paise (₹1 = 100)
+            note TEXT,
+            txn_type TEXT,          -- TXN_TYPES (ledger_engine)
+            status TEXT             -- TXN_STATUSES
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS opening_balances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER REFERENCES accounts (id),
+            balance INTEGER,        -- paise
+            type TEXT,              -- 'Debit' or 'Credit'
+            financial_year TEXT    -- '2024-25 etc'
+        )
+    ''')
+
+
+def _add_account_ids(cursor):
+    """
+    Migration 2: from_acc/to_acc/account_name (TEXT) को accounts.id पर ले आओ।
+
+    Names that no longer exist in accounts (renamed parties) get their account
+    back so no history is lost. transactions gains from_id / to_id, filled by
+    the returned backfill, which empties the old name columns as it goes
+    (dropping them would rewrite the whole table in one transaction).
+    opening_balances is small and is rebuilt right here.
+    """
+    columns = _columns(cursor, "transactions")
+    if 'from_acc' not in columns:
+        return None
+    if 'from_id' not in columns:
+        _drop_derived(cursor)
+        cursor.execute("ALTER TABLE transactions ADD COLUMN from_id INTEGER REFERENCES accounts (id)")
+        cursor.execute("ALTER TABLE transactions ADD COLUMN to_id INTEGER REFERENCES accounts (id)")
+
+    named_opening = 'account_name' in _columns(cursor, "opening_balances")
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO accounts (name, is_active, group_type)
+        SELECT from_acc, 1, 'Party' FROM transactions WHERE from_acc IS NOT NULL
+        UNION SELECT to_acc, 1, 'Party' FROM transactions WHERE to_acc IS NOT NULL
+        {"UNION SELECT account_name, 1, 'Party' FROM opening_balances WHERE account_name IS NOT NULL" if named_opening else ""}
+    ''')
+
+    if named_opening:
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS accounts (
+            CREATE TABLE opening_balances_new (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                phone TEXT,
-                group_type TEXT,
-                address TEXT,
-                is_active INTEGER DEFAULT 1
+                account_id INTEGER REFERENCES accounts (id),
+                balance REAL,
+                type TEXT,              -- 'Debit' or 'Credit'
+                financial_year TEXT    -- '2024-25 etc'
             )
         ''')
-        
-        # अगर यह जानकारी पहले से मौजूद है, तो इसे दोबारा मत डालो और चुपचाप आगे बढ़ जाओ
-        # 2. Transactions Table
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                date TEXT, 
-                from_acc TEXT, 
-                to_acc TEXT, 
-                amount REAL, 
-                note TEXT
-            )
+            INSERT INTO opening_balances_new (id, account_id, balance, type, financial_year)
+            SELECT ob.id, a.id, ob.balance, ob.type, ob.financial_year
+            FROM opening_balances ob
+            LEFT JOIN accounts a ON a.name = ob.account_name
         ''')
-        
+        cursor.execute("DROP TABLE opening_balances")
+        cursor.execute("ALTER TABLE opening_balances_new RENAME TO opening_balances")
+
+    return _update(
+        "transactions",
+        "from_id = (SELECT id FROM accounts WHERE name = from_acc),"
+        " to_id = (SELECT id FROM accounts WHERE name = to_acc), from_acc = NULL, to_acc = NULL",
+        "from_acc IS NOT NULL OR to_acc IS NOT NULL",
+    )
+
+
+def _add_paise_amounts(cursor):
+    """
+    Migration 3: transactions.amount और opening_balances.balance को REAL rupees से INTEGER paise पर ले आओ।
+
+    SQLite cannot change a column type in place, so the REAL column is renamed
+    to amount_rupees and a new INTEGER amount is filled from it by the returned
+    backfill, which empties amount_rupees as it goes. opening_balances is small
+    and is rebuilt right here.
+    """
+    cursor.execute("PRAGMA table_info(transactions)")
+    if {col[1]: col[2] for col in cursor.fetchall()}.get('amount') == 'REAL':
+        _drop_derived(cursor)
+        cursor.execute("ALTER TABLE transactions RENAME COLUMN amount TO amount_rupees")
+        cursor.execute("ALTER TABLE transactions ADD COLUMN amount INTEGER")
+
+    cursor.execute("PRAGMA table_info(opening_balances)")
+    if {col[1]: col[2] for col in cursor.fetchall()}.get('balance') == 'REAL':
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS opening_balances (
+            CREATE TABLE opening_balances_new (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                account_name TEXT,
-                balance REAL,
+                account_id INTEGER REFERENCES accounts (id),
+                balance INTEGER,        -- paise
                 type TEXT,              -- 'Debit' or 'Credit'
                 financial_year TEXT    -- '2024-25 etc'
             )
-        ''')       
-        
-        # 3. अपडेटेड डिफ़ॉल्ट खाते
-        # यहाँ 'Plot Filling Expense' को बदलकर 'Construction Expense' कर दिया गया है
-        defaults = [
-            'Cash', 'Bank', 'Sales Income', 'Personal Expense',
-            'Office Expenses', 'Conveyance', 'Miscellaneous',
-            'School Expenses', 'Bills', 'Salary Expense', 'Construction Expense'
-        ]
-
-        for name in defaults:
-            cursor.execute("""
-                INSERT OR IGNORE INTO accounts (name, is_active, group_type) 
-                VALUES (?, 1, 'Party')
-            """, (name,))
-           
-        conn.commit()
-       
-# इसे सिर्फ एक बार रन करना है ताकि टेबल अपडेट हो जाए
+        ''')
+        cursor.execute('''
+            INSERT INTO opening_balances_new (id, account_id, balance, type, financial_year)
+            SELECT id, account_id, CAST(ROUND(balance * 100) AS INTEGER), type, financial_year
+            FROM opening_balances
+        ''')
+        cursor.execute("DROP TABLE opening_balances")
+        cursor.execute("ALTER TABLE opening_balances_new RENAME TO opening_balances")
+
+    if 'amount_rupees' not in _columns(cursor, "transactions"):
+        return None
+    return _update(
+        "transactions",
+        "amount = CAST(ROUND(amount_rupees * 100) AS INTEGER), amount_rupees = NULL",
+        "amount_rupees IS NOT NULL",
+    )
+
+
+def _add_txn_type_status(cursor):
+    """
+    Migration 4: txn_type / status columns जोड़ो और पुराने notes से भरो।
+
+    Notes saved as "[Type] | Status: X | remark" are split into the two
+    columns and the bare remark by the returned backfill. Other notes are
+    left as they are.
+    """
+    if 'txn_type' not in _columns(cursor, "transactions"):
+        cursor.execute("ALTER TABLE transactions ADD COLUMN txn_type TEXT")
+        cursor.execute("ALTER TABLE transactions ADD COLUMN status TEXT")
+
+        # Search index नए columns के साथ दोबारा बनेगा; backfill की हर row journal में नहीं चाहिए
+        # (ये सब आगे की migrations में फिर से बन जाते हैं)
+        for trigger in ("fts_insert", "fts_update", "fts_delete", "fts_account_rename", "log_transactions_update"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute("DROP TABLE IF EXISTS transactions_fts")
+
+    # SET के सारे expressions पुराने note को देखते हैं; '] | Status: ' 12 अक्षर का है
+    return _update("transactions", """
+            txn_type = substr(note, 2, instr(note, '] | Status: ') - 2),
+            status = substr(
+                substr(note, instr(note, '] | Status: ') + 12), 1,
+                instr(substr(note, instr(note, '] | Status: ') + 12), ' | ') - 1
+            ),
+            note = substr(
+                substr(note, instr(note, '] | Status: ') + 12),
+                instr(substr(note, instr(note, '] | Status: ') + 12), ' | ') + 3
+            )
+    """, "txn_type IS NULL AND note LIKE '[%] | Status: % | %'")
+
+
+def _add_day_column(cursor):
+    """Migration 5: integer day column और date validation"""
+    # date (YYYY-MM-DD text) के साथ integer day number: days since 1970-01-01.
+    # Generated column है, इसलिए date से कभी अलग नहीं हो सकता
+    cursor.execute("PRAGMA table_xinfo(transactions)")
+    if 'day' not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute('''
+            ALTER TABLE transactions ADD COLUMN
+            day INTEGER GENERATED ALWAYS AS (CAST(julianday(date) - 2440587.5 AS INTEGER)) VIRTUAL
+        ''')
+    # सिर्फ असली dates: julianday से वापस बनी date वही string हो (2025-1-5, 2025-02-30 जैसी values reject)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS transactions_date_insert BEFORE INSERT ON transactions
+        WHEN NEW.date IS NOT date(julianday(NEW.date))
+        BEGIN
+            SELECT RAISE(ABORT, 'transactions.date must be a valid YYYY-MM-DD date');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS transactions_date_update BEFORE UPDATE OF date ON transactions
+        WHEN NEW.date IS NOT date(julianday(NEW.date))
+        BEGIN
+            SELECT RAISE(ABORT, 'transactions.date must be a valid YYYY-MM-DD date');
+        END
+    ''')
+
+
+def _add_change_journal(cursor):
+    """Migration 6: changes journal और उसके triggers"""
+    # Change journal: हर insert/update/delete का एक sequence number
+    # ताकि in-memory cache सिर्फ बदली हुई rows दोबारा पढ़े (और incremental backup सिर्फ वही rows ले)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL        -- 'I', 'U' or 'D'
+        )
+    ''')
+    # opening_balances भी journal में: incremental backups (ledger_backup) इन्हीं से बनते हैं
+    for table in ('transactions', 'accounts', 'opening_balances'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS log_{table}_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO changes (table_name, row_id, op) VALUES ('{table}', NEW.id, 'I');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS log_{table}_update AFTER UPDATE ON {table}
+            BEGIN
+                INSERT INTO changes (table_name, row_id, op) VALUES ('{table}', NEW.id, 'U');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS log_{table}_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO changes (table_name, row_id, op) VALUES ('{table}', OLD.id, 'D');
+            END
+        ''')
+
+
+def _add_account_balances(cursor):
+    """Migration 7: account_balances table, triggers और (पहली बार) भरना"""
+    # Materialized per-account totals, triggers से हर write पर अपडेट होते हैं
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='account_balances'")
+    balances_existed = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS account_balances (
+            account_id INTEGER PRIMARY KEY,
+            total_in INTEGER NOT NULL DEFAULT 0,    -- paise
+            total_out INTEGER NOT NULL DEFAULT 0,
+            txn_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS balances_insert AFTER INSERT ON transactions
+        BEGIN
+            INSERT OR IGNORE INTO account_balances (account_id) VALUES (NEW.to_id), (NEW.from_id);
+            UPDATE account_balances SET total_in = total_in + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.to_id;
+            UPDATE account_balances SET total_out = total_out + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.from_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS balances_delete AFTER DELETE ON transactions
+        BEGIN
+            UPDATE account_balances SET total_in = total_in - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.to_id;
+            UPDATE account_balances SET total_out = total_out - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.from_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS balances_update AFTER UPDATE OF from_id, to_id, amount ON transactions
+        BEGIN
+            UPDATE account_balances SET total_in = total_in - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.to_id;
+            UPDATE account_balances SET total_out = total_out - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.from_id;
+            INSERT OR IGNORE INTO account_balances (account_id) VALUES (NEW.to_id), (NEW.from_id);
+            UPDATE account_balances SET total_in = total_in + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.to_id;
+            UPDATE account_balances SET total_out = total_out + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.from_id;
+        END
+    ''')
+    if not balances_existed:
+        # पुराने DB में पहली बार: मौजूदा transactions से भर दो
+        _fill_account_balances(cursor)
+
+
+def _add_daily_totals(cursor):
+    """Migration 8: daily_totals rollup"""
+    # Daily rollup (analytics charts): हर दिन, account और direction का total;
+    # chart की cost दिनों की गिनती पर निर्भर करती है, transactions पर नहीं
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_totals'")
+    daily_existed = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            account_id INTEGER NOT NULL,
+            direction TEXT NOT NULL,            -- 'in' (to_id) or 'out' (from_id)
+            day INTEGER NOT NULL,               -- transactions.day
+            total INTEGER NOT NULL DEFAULT 0,   -- paise
+            txn_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, direction, day)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS daily_totals_insert AFTER INSERT ON transactions
+        BEGIN
+            INSERT OR IGNORE INTO daily_totals (account_id, direction, day)
+                VALUES (NEW.to_id, 'in', NEW.day), (NEW.from_id, 'out', NEW.day);
+            UPDATE daily_totals SET total = total + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.to_id AND direction = 'in' AND day = NEW.day;
+            UPDATE daily_totals SET total = total + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.from_id AND direction = 'out' AND day = NEW.day;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS daily_totals_delete AFTER DELETE ON transactions
+        BEGIN
+            UPDATE daily_totals SET total = total - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.to_id AND direction = 'in' AND day = OLD.day;
+            UPDATE daily_totals SET total = total - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.from_id AND direction = 'out' AND day = OLD.day;
+            DELETE FROM daily_totals WHERE txn_count = 0
+                AND ((account_id = OLD.to_id AND direction = 'in' AND day = OLD.day)
+                  OR (account_id = OLD.from_id AND direction = 'out' AND day = OLD.day));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS daily_totals_update AFTER UPDATE OF date, from_id, to_id, amount ON transactions
+        BEGIN
+            UPDATE daily_totals SET total = total - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.to_id AND direction = 'in' AND day = OLD.day;
+            UPDATE daily_totals SET total = total - OLD.amount, txn_count = txn_count - 1
+                WHERE account_id = OLD.from_id AND direction = 'out' AND day = OLD.day;
+            INSERT OR IGNORE INTO daily_totals (account_id, direction, day)
+                VALUES (NEW.to_id, 'in', NEW.day), (NEW.from_id, 'out', NEW.day);
+            UPDATE daily_totals SET total = total + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.to_id AND direction = 'in' AND day = NEW.day;
+            UPDATE daily_totals SET total = total + NEW.amount, txn_count = txn_count + 1
+                WHERE account_id = NEW.from_id AND direction = 'out' AND day = NEW.day;
+            DELETE FROM daily_totals WHERE txn_count = 0
+                AND ((account_id = OLD.to_id AND direction = 'in' AND day = OLD.day)
+                  OR (account_id = OLD.from_id AND direction = 'out' AND day = OLD.day));
+        END
+    ''')
+    if not daily_existed:
+        _fill_daily_totals(cursor)
+
+
+def _add_indexes(cursor):
+    """Migration 9: transactions और opening_balances के indexes"""
+    # Indexes: book filter (from_id/to_id), day range और opening balance lookup.
+    # पुराने TEXT date वाले indexes की जगह integer day वाले
+    for old_index in ("idx_transactions_from", "idx_transactions_to", "idx_transactions_date"):
+        cursor.execute(f"DROP INDEX IF EXISTS {old_index}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_from_day ON transactions (from_id, day, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_to_day ON transactions (to_id, day, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_day ON transactions (day)")
+    # "सारी pending Contract/Deal entries" जैसे filters
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_type_status ON transactions (txn_type, status, day)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_status ON transactions (status, day)")
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_opening_account_year'")
+    if cursor.fetchone() is None:
+        # UNIQUE index से पहले duplicate (account, year) rows हटाओ - सबसे नई entry रखो
+        cursor.execute('''
+            DELETE FROM opening_balances WHERE id NOT IN (
+                SELECT MAX(id) FROM opening_balances GROUP BY account_id, financial_year
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX idx_opening_account_year
+            ON opening_balances (account_id, financial_year)
+        ''')
+
+
+def _add_search_index(cursor):
+    """Migration 10: FTS5 search index और triggers; returns the batched fill"""
+    # Full-text search index (Advanced Search tab); rowid = transactions.id
+    # M* categories ताकि हिंदी की मात्राएँ शब्द को न तोड़ें
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+            note, from_acc, to_acc, amount, date, txn_type, status,
+            tokenize = "unicode61 categories 'L* N* Co M*'",
+            prefix = '2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS fts_insert AFTER INSERT ON transactions
+        BEGIN
+            INSERT INTO transactions_fts (rowid, note, from_acc, to_acc, amount, date, txn_type, status)
+            VALUES (NEW.id, NEW.note,
+                    (SELECT name FROM accounts WHERE id = NEW.from_id),
+                    (SELECT name FROM accounts WHERE id = NEW.to_id),
+                    printf('%.2f', NEW.amount / 100.0), NEW.date, NEW.txn_type, NEW.status);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS fts_delete AFTER DELETE ON transactions
+        BEGIN
+            DELETE FROM transactions_fts WHERE rowid = OLD.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS fts_update AFTER UPDATE ON transactions
+        BEGIN
+            DELETE FROM transactions_fts WHERE rowid = OLD.id;
+            INSERT INTO transactions_fts (rowid, note, from_acc, to_acc, amount, date, txn_type, status)
+            VALUES (NEW.id, NEW.note,
+                    (SELECT name FROM accounts WHERE id = NEW.from_id),
+                    (SELECT name FROM accounts WHERE id = NEW.to_id),
+                    printf('%.2f', NEW.amount / 100.0), NEW.date, NEW.txn_type, NEW.status);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS fts_account_rename AFTER UPDATE OF name ON accounts
+        BEGIN
+            -- Party का नाम बदला: सिर्फ उसकी entries का search text दोबारा बनाओ
+            DELETE FROM transactions_fts WHERE rowid IN (
+                SELECT id FROM transactions WHERE from_id = NEW.id
+                UNION SELECT id FROM transactions WHERE to_id = NEW.id
+            );
+            INSERT INTO transactions_fts (rowid, note, from_acc, to_acc, amount, date, txn_type, status)
+            SELECT t.id, t.note, f.name, o.name, printf('%.2f', t.amount / 100.0), t.date, t.txn_type, t.status
+            FROM transactions t
+            LEFT JOIN accounts f ON f.id = t.from_id
+            LEFT JOIN accounts o ON o.id = t.to_id
+            WHERE t.id IN (
+                SELECT id FROM transactions WHERE from_id = NEW.id
+                UNION SELECT id FROM transactions WHERE to_id = NEW.id
+            );
+        END
+    ''')
+    # पहले से indexed rows छोड़ दो: बीच में रुका fill अगली बार वहीं से चलता है
+    return ("transactions", '''
+        INSERT INTO transactions_fts (rowid, note, from_acc, to_acc, amount, date, txn_type, status)
+        SELECT t.id, t.note, f.name, o.name, printf('%.2f', t.amount / 100.0), t.date, t.txn_type, t.status
+        FROM transactions t
+        LEFT JOIN accounts f ON f.id = t.from_id
+        LEFT JOIN accounts o ON o.id = t.to_id
+        WHERE t.id >= :start AND t.id < :end
+          AND NOT EXISTS (SELECT 1 FROM transactions_fts WHERE rowid = t.id)
+    ''')
+
+
+def _add_party_trigrams(cursor):
+    """Migration 11: party names का trigram index"""
+    # Trigram index on party names for duplicate / "did you mean" checks; rowid = accounts.id
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='party_trigrams'")
+    trigrams_existed = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS party_trigrams USING fts5(name, tokenize = 'trigram')
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS party_trigrams_insert AFTER INSERT ON accounts
+        BEGIN
+            INSERT INTO party_trigrams (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS party_trigrams_rename AFTER UPDATE OF name ON accounts
+        BEGIN
+            DELETE FROM party_trigrams WHERE rowid = OLD.id;
+            INSERT INTO party_trigrams (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS party_trigrams_delete AFTER DELETE ON accounts
+        BEGIN
+            DELETE FROM party_trigrams WHERE rowid = OLD.id;
+        END
+    ''')
+    if not trigrams_existed:
+        cursor.execute("INSERT INTO party_trigrams (rowid, name) SELECT id, name FROM accounts")
+
+
+def _add_default_accounts(cursor):
+    """Migration 12: डिफ़ॉल्ट खाते"""
+    # अपडेटेड डिफ़ॉल्ट खाते
+    # यहाँ 'Plot Filling Expense' को बदलकर 'Construction Expense' कर दिया गया है
+    defaults = [
+        'Cash', 'Bank', 'Sales Income', 'Personal Expense',
+        'Office Expenses', 'Conveyance', 'Miscellaneous',
+        'School Expenses', 'Bills', 'Salary Expense', 'Construction Expense'
+    ]
+
+    for name in defaults:
+        cursor.execute("""
+            INSERT OR IGNORE INTO accounts (name, is_active, group_type) 
+            VALUES (?, 1, 'Party')
+        """, (name,))
+
+
+def _party_group_type(cursor):
+    """Migration 13: Party Directory से register हुई parties group_type के बिना आती थीं"""
+    return _update("accounts", "group_type = 'Party'", "group_type IS NULL")
+
+
 def upgrade_database():
-    conn = sqlite3.connect("business_ledger.db") # अपने DB का नाम लिखें
-    cursor = conn.cursor()
-    try:
-        cursor.execute("ALTER TABLE accounts ADD COLUMN group_type TEXT DEFAULT 'Party'")
-        conn.commit()
-        print("✅ Database updated successfully!")
-    except Exception as e:
-        print(f"Note: {e}") # अगर कॉलम पहले से है तो एरर आएगा जिसे इग्नोर कर सकते हैं
-    finally:
-        conn.close()
+    """पुरानी DB को नए schema पर लाओ (अब यह सिर्फ migrate() है, बार-बार चलाना safe है)"""
+    version = migrate(lambda title, done, total: print(f"⏳ {title}: {done:,}/{total:,}"))
+    print(f"✅ Database is at schema version {version}")
+
+def _fill_account_balances(cursor):
+    cursor.execute("DELETE FROM account_balances")
+    cursor.execute('''
+        INSERT INTO account_balances (account_id, total_in, total_out, txn_count)
+        SELECT account_id, SUM(amt_in), SUM(amt_out), COUNT(*) FROM (
+            SELECT to_id AS account_id, amount AS amt_in, 0 AS amt_out FROM transactions
+            UNION ALL
+            SELECT from_id, 0, amount FROM transactions
+        )
+        GROUP BY account_id
+    ''')
+
+def _fill_daily_totals(cursor):
+    cursor.execute("DELETE FROM daily_totals")
+    cursor.execute('''
+        INSERT INTO daily_totals (account_id, direction, day, total, txn_count)
+        SELECT to_id, 'in', day, SUM(amount), COUNT(*) FROM transactions GROUP BY to_id, day
+        UNION ALL
+        SELECT from_id, 'out', day, SUM(amount), COUNT(*) FROM transactions GROUP BY from_id, day
+    ''')
+
+def _add_row_versions(cursor):
+    """Migration 14: optimistic locking - हर सफल edit/delete row का version बढ़ाता है"""
+    for table in ("transactions", "accounts"):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if 'version' not in [col[1] for col in cursor.fetchall()]:
+            # constant DEFAULT वाला ADD COLUMN सिर्फ schema बदलता है, rows नहीं लिखता
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+# Numbered schema migrations. DB file पर PRAGMA user_version = आखिरी लगी migration;
+# schema बदलना हो तो यहाँ नई entry जोड़ो, पुरानी entries को कभी मत बदलो।
+#   (version, title, apply(cursor))
+# apply एक BEGIN IMMEDIATE transaction में चलता है और सिर्फ छोटे काम करता है (DDL, छोटी tables).
+# बड़ी table की rows बदलनी हों तो वो (table, statement) backfill लौटाता है: statement
+# id-range batches (:start <= id < :end) में चलता है, हर batch अपने transaction में,
+# ताकि upgrade के दौरान write lock हर batch के बाद छूटे। Backfills idempotent हैं।
+MIGRATIONS = [
+    (1, "base tables", _base_tables),
+    (2, "account ids", _add_account_ids),
+    (3, "amounts in paise", _add_paise_amounts),
+    (4, "txn type / status", _add_txn_type_status),
+    (5, "day column", _add_day_column),
+    (6, "change journal", _add_change_journal),
+    (7, "account balances", _add_account_balances),
+    (8, "daily totals", _add_daily_totals),
+    (9, "indexes", _add_indexes),
+    (10, "search index", _add_search_index),
+    (11, "party trigrams", _add_party_trigrams),
+    (12, "default accounts", _add_default_accounts),
+    (13, "accounts.group_type", _party_group_type),
+    (14, "row versions", _add_row_versions),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+BACKFILL_BATCH = 20000
+
+
+def _backfill(connect, title, table, statement, progress):
+    with connect() as conn:
+        low, high = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+    if low is None:
+        return
+    total = high - low + 1
+    for start in range(low, high + 1, BACKFILL_BATCH):
+        with connect() as conn:
+            conn.execute(statement, {"start": start, "end": start + BACKFILL_BATCH})
+        if progress:
+            progress(title, min(start + BACKFILL_BATCH - low, total), total)
+
+
+def _is_pending(conn, number):
+    # किसी और process ने इसी बीच यह migration लगा दी हो तो दोबारा नहीं
+    return conn.execute("PRAGMA user_version").fetchone()[0] < number
+
+
+def migrate(progress=None, db_file=None):
+    """
+    Bring the database up to SCHEMA_VERSION; returns the version it ends at.
+    With `db_file`, that file is migrated instead of the live database (a
+    restore's spooled copy, before it replaces the live one).
+
+    An up-to-date database costs one PRAGMA read. Each pending migration's
+    apply() runs in its own BEGIN IMMEDIATE transaction (re-checking the
+    version inside it, so a second process waits and then skips), then the
+    backfill it returned in batches, and only then is user_version bumped -
+    steps are idempotent, so an interrupted backfill simply resumes on the
+    next start. progress(title, done, total) is called after every backfill
+    batch (rows) and every finished migration (versions).
+
+    Migrations write directly, not through the writer queue, so the writer
+    thread is paused until they are done; queued writes wait and then run
+    on the new schema.
+    """
+    if db_file is not None:
+        # Live DB नहीं है: writer से कोई लेना-देना नहीं, अपना छोटा pool
+        pool = ConnectionPool(db_file, size=1)
+        try:
+            return _migrate(pool.connection, progress)
+        finally:
+            pool.close_all()
+
+    with connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    with writer.paused():
+        return _migrate(connection, progress)
+
+
+def _migrate(connect, progress):
+    with connect() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for number, title, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        backfill = None
+        with connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if _is_pending(conn, number):
+                backfill = apply(conn.cursor())
+                if backfill is None:
+                    conn.execute(f"PRAGMA user_version = {number}")
+        if backfill is not None:
+            _backfill(connect, title, *backfill, progress)
+            with connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if _is_pending(conn, number):
+                    conn.execute(f"PRAGMA user_version = {number}")
+        version = number
+        if progress:
+            progress(title, number, SCHEMA_VERSION)
+    return version
+
+
+def init_db(progress=None):
+    """डेटाबेस और टेबल्स को इनिशियलाइज़ करें = हर बाकी migration चलाओ"""
+    return migrate(progress)
+
+
+def rebuild_account_balances():
+    """account_balances को transactions से शुरू से दोबारा बनाएं।
+
+    Returns the accounts whose stored totals did not match the fresh ones.
+    Runs as one write on the writer thread, so the stored totals are read in
+    the same transaction as the rebuild and no write can land in between.
+    """
+    def rebuild(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT account_id, total_in, total_out, txn_count FROM account_balances WHERE txn_count != 0")
+        stored = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        _fill_account_balances(cursor)
+        cursor.execute("SELECT account_id, total_in, total_out, txn_count FROM account_balances")
+        fresh = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        cursor.execute("SELECT id, name FROM accounts")
+        return stored, fresh, dict(cursor.fetchall())
+
+    stored, fresh, names = write(rebuild)
+
+    mismatched = []
+    for acc_id in set(stored) | set(fresh):
+        old = stored.get(acc_id, (0, 0, 0))
+        new = fresh.get(acc_id, (0, 0, 0))
+        # Totals integer paise में हैं, इसलिए exact बराबरी
+        if old != new:
+            mismatched.append(names.get(acc_id, f"#{acc_id}"))
+    return sorted(mismatched, key=str)
+
+# Hot queries और वो index जो उन्हें इस्तेमाल करना चाहिए
+Q1_START, Q1_END = day_number(datetime.date(2026, 1, 1)), day_number(datetime.date(2026, 3, 31))
+HOT_QUERIES = {
+    "book statement": (
+        STATEMENT_SQL,
+        {"acc": 1, "start": Q1_START, "end": Q1_END},
+    ),
+    "balance carried forward": (
+        CARRIED_FORWARD_SQL,
+        {"acc": 1, "start": Q1_START},
+    ),
+    "trial balance as of": (
+        TRIAL_TOTALS_SQL,
+        {"as_of": Q1_END},
+    ),
+    "trial balance tail": (
+        TRIAL_TAIL_SQL,
+        {"as_of": Q1_END},
+    ),
+    "party transaction count": (
+        "SELECT COUNT(*) FROM transactions WHERE from_id = ? OR to_id = ?",
+        (1, 1),
+    ),
+    "date range": (
+        "SELECT * FROM transactions WHERE day BETWEEN ? AND ?",
+        (Q1_START, Q1_END),
+    ),
+    "opening balance": (
+        OPENING_BALANCE_SQL,
+        ("Cash", "2025-26"),
+    ),
+    "pending contracts": (
+        "SELECT * FROM transactions WHERE txn_type = ? AND status IN (?, ?)",
+        ("Contract/Deal", "Work Started", "In Progress"),
+    ),
+    "daily inflow trends": (
+        INFLOW_TRENDS_SQL.format(marks="?, ?"),
+        ("Cash", "Bank"),
+    ),
+}
+
+# इन tables का full scan हमेशा गलत है (बाकी - accounts, subqueries - छोटे हैं)
+LARGE_TABLES = ("transactions", "opening_balances", "daily_totals")
+
+# FROM / JOIN <table> [AS] <alias>: query plan table का alias ही दिखाता है ("SCAN t")
+TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+NOT_ALIASES = {"WHERE", "JOIN", "LEFT", "INNER", "CROSS", "ON", "USING", "GROUP", "ORDER", "UNION", "LIMIT"}
+
+
+def _large_table_names(query):
+    """LARGE_TABLES plus the aliases `query` gives them"""
+    names = set(LARGE_TABLES)
+    for table, alias in TABLE_REF.findall(query):
+        if table.lower() in LARGE_TABLES and alias and alias.upper() not in NOT_ALIASES:
+            names.add(alias)
+    return names
+
+
+def check_query_plans():
+    """EXPLAIN QUERY PLAN से पक्का करें कि कोई hot query full table scan नहीं कर रही।
+
+    Returns {name: [plan lines]}; raises AssertionError if a query scans a table.
+    """
+    plans = {}
+    with connection() as conn:
+        for name, (query, params) in HOT_QUERIES.items():
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+            lines = [row[-1] for row in rows]
+            # Subquery (UNION के rows) या छोटी accounts table का scan ठीक है; बड़ी tables
+            # का नहीं, चाहे नाम से हो या alias से ("SCAN t" for "transactions t")
+            large = _large_table_names(query)
+            scans = [line for line in lines if line.split()[0] == "SCAN" and line.split()[1] in large]
+            assert not scans, f"{name}: full table scan ({'; '.join(scans)})"
+            plans[name] = lines
+    return plans
          
 def reset_database():
     """सावधानी: यह सभी ट्रांजेक्शन मिटा देगा!"""
-    with sqlite3.connect('business_ledger.db') as conn:
+    def reset(conn):
         cursor = conn.cursor()
         cursor.execute("DELETE FROM transactions")
         cursor.execute("DELETE FROM sqlite_sequence WHERE name='transactions'")
-        conn.commit()
+
+    write(reset)
     print("Database Transactions Reset Successfully!")
     
 # ऐप के स्टार्टअप पर इसे रन करें -> I've done in main application file
-#init_db()
\ No newline at end of file
+#init_db()
+
+if __name__ == "__main__":
+    # python setup_db.py -> schema/indexes बनाओ और query plans check करो
+    init_db()
+    for name, lines in check_query_plans().items():
+        print(f"✅ {name}: {' | '.join(lines)}")
\ No newline at end of file
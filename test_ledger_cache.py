@@ -0,0 +1,119 @@
+import gc
+
+import pandas as pd
+import pytest
+
+from db_pool import connection
+from ledger_backup import create_backup, create_incremental_backup
+from ledger_cache import LedgerCache
+from ledger_engine import add_transaction, update_transaction, delete_transaction, update_account
+from write_queue import write
+
+
+def assert_matches_full_reload(cache):
+    acc_df, trans_df = cache.snapshot()
+    fresh_acc, fresh_trans = LedgerCache().snapshot()
+    pd.testing.assert_frame_equal(acc_df, fresh_acc)
+    pd.testing.assert_frame_equal(trans_df, fresh_trans)
+
+
+@pytest.fixture
+def cache(ledger_db, monkeypatch):
+    for i in range(20):
+        add_transaction(f"2024-04-{1 + i % 7:02d}", "Sales Income", "Cash", 100 + i, f"sale {i}", "Payment", "N/A")
+    cache = LedgerCache()
+    cache.snapshot()
+
+    # पहली load के बाद हर refresh incremental ही होना चाहिए
+    def no_full_reload(conn):
+        raise AssertionError("full reload")
+    monkeypatch.setattr(cache, "_load_transactions", no_full_reload)
+    return cache
+
+
+def test_insert(cache):
+    add_transaction("2024-04-10", "Cash", "Bank", 50.25, "deposit")
+    assert_matches_full_reload(cache)
+
+
+def test_update(cache):
+    update_transaction(3, "2024-03-31", "Cash", "Personal Expense", 7.77, "moved", "Adjustment", "Completed")
+    assert_matches_full_reload(cache)
+
+
+def test_delete(cache):
+    delete_transaction(5)
+    delete_transaction(20)  # सबसे नई row भी
+    assert_matches_full_reload(cache)
+
+
+def test_party_rename(cache):
+    with connection() as conn:
+        cash_id = conn.execute("SELECT id FROM accounts WHERE name = 'Cash'").fetchone()[0]
+    update_account(cash_id, "Cash in Hand", "", "", 1)
+    assert_matches_full_reload(cache)
+    assert "Cash in Hand" in set(cache.snapshot()[1]["to_acc"])
+
+
+def test_mixed_writes_between_refreshes(cache):
+    write(lambda conn: conn.execute("INSERT INTO accounts (name, group_type) VALUES ('New Party', 'Party')"))
+    new = add_transaction("2024-04-11", "Cash", "New Party", 300, "advance")
+    update_transaction(new, "2024-04-12", "Bank", "New Party", 310, "advance (corrected)")
+    delete_transaction(1)
+    update_transaction(2, "2024-04-02", "Sales Income", "Bank", 101, "sale 1")
+    assert_matches_full_reload(cache)
+
+    # दूसरा refresh: बीच में कुछ नहीं बदला
+    assert_matches_full_reload(cache)
+
+
+@pytest.fixture
+def pruning(monkeypatch):
+    """Prune on every refresh; caches of earlier tests (kept alive by fixture cycles) must not hold it back"""
+    gc.collect()
+    monkeypatch.setattr(LedgerCache, "PRUNE_EVERY", 1)
+
+
+def journal():
+    """(oldest seq, newest seq, rows) of the changes journal - after queued writes (prune) are done"""
+    write(lambda conn: None)
+    with connection() as conn:
+        return conn.execute("SELECT MIN(seq), MAX(seq), COUNT(*) FROM changes").fetchone()
+
+
+def test_snapshot_after_pruning(cache, pruning, monkeypatch):
+    lagging = LedgerCache()
+    lagging.snapshot()
+    monkeypatch.setattr(lagging, "_load_transactions", cache._load_transactions)
+    lag_seq = lagging.seq
+
+    add_transaction("2024-04-10", "Cash", "Bank", 50.25, "deposit")
+    update_transaction(3, "2024-03-31", "Cash", "Personal Expense", 7.77, "moved")
+    delete_transaction(5)
+    assert_matches_full_reload(cache)
+    # पीछे वाली cache को जिन rows की ज़रूरत है वो बचीं
+    assert journal()[0] == lag_seq
+
+    update_transaction(4, "2024-04-04", "Bank", "Cash", 1, "after prune")
+    delete_transaction(6)
+    assert_matches_full_reload(lagging)
+    assert_matches_full_reload(cache)
+
+    # दोनों आगे बढ़ गईं: सिर्फ newest row बची, journal position वही
+    newest = journal()[1]
+    assert journal() == (newest, newest, 1)
+
+    add_transaction("2024-04-12", "Sales Income", "Cash", 20, "sale after prune")
+    assert_matches_full_reload(cache)
+    assert_matches_full_reload(lagging)
+
+
+def test_pruning_keeps_rows_after_the_latest_full_backup(cache, pruning):
+    full = create_backup()
+    add_transaction("2024-04-10", "Cash", "Bank", 50.25, "deposit")
+    delete_transaction(7)
+    assert_matches_full_reload(cache)
+    assert journal()[0] == full["seq"]
+
+    delta = create_incremental_backup()
+    assert (delta["from_seq"], delta["rows"]) == (full["seq"], 2)
@@ -0,0 +1,198 @@
+import datetime
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import db_pool
+from ledger_engine import (
+    build_ledger, get_statement, get_carried_forward, add_transaction, update_transaction, delete_transaction, get_transaction,
+    update_account, EditConflict
+)
+from money import to_paise
+
+BOOK = "Cash"
+START = datetime.date(2024, 4, 1)
+
+
+def legacy_ledger(book, df, opening_total, start_date):
+    """Books statement का पुराना iterrows() loop, जैसा build_ledger से पहले main_cloud में था"""
+    running_balance = opening_total
+    ledger_rows = [{
+        "Date": start_date,
+        "Particular": "Opening Balance",
+        "Debit": opening_total if opening_total > 0 else 0.0,
+        "Credit": abs(opening_total) if opening_total < 0 else 0.0,
+        "Balance": opening_total,
+        "Note": "Balance brought forward",
+        "ID": "",
+    }]
+    for _, row in df.iterrows():
+        if row["to_acc"] == book:
+            debit = row["amount"]
+            credit = 0.0
+            running_balance += debit
+            particular = f"From {row['from_acc']}"
+        else:
+            debit = 0.0
+            credit = row["amount"]
+            running_balance -= credit
+            particular = f"To {row['to_acc']}"
+        ledger_rows.append({
+            "Date": row["date"],
+            "Particular": particular,
+            "Debit": debit,
+            "Credit": credit,
+            "Balance": running_balance,
+            "Note": row["note"],
+            "ID": row["id"],
+        })
+    return pd.DataFrame(ledger_rows)
+
+
+def statement(rows):
+    """get_statement() जैसा frame: (id, date, from_acc, to_acc, amount) rows, date + id के क्रम में"""
+    df = pd.DataFrame(rows, columns=["id", "date", "from_acc", "to_acc", "amount"])
+    df["date"] = pd.to_datetime(df["date"])
+    df["amount"] = df["amount"].astype(float)
+    df["note"] = [f"note {i}" for i in df["id"]]
+    df["txn_type"] = "Payment"
+    df["status"] = "N/A"
+    return df
+
+
+def assert_same_ledger(df, opening_total):
+    new = build_ledger(BOOK, df, opening_total, START)
+    old = legacy_ledger(BOOK, df, opening_total, START)
+
+    assert len(new) == len(old)
+    for col in ("Debit", "Credit", "Balance"):
+        assert to_paise(new[col]).tolist() == to_paise(old[col].astype(float)).tolist(), col
+    assert new["Particular"].tolist() == old["Particular"].tolist()
+    assert new["Note"].tolist() == old["Note"].tolist()
+    assert new["ID"].tolist()[1:] == old["ID"].tolist()[1:]
+
+
+MIXED_ROWS = [
+    (1, "2024-04-01", "Sales", BOOK, 1500.25),
+    (2, "2024-04-01", BOOK, "Rent", 800.10),
+    (3, "2024-04-02", BOOK, "Bank", 0.05),
+    (4, "2024-04-02", "Bank", BOOK, 12345.67),
+    (5, "2024-04-03", BOOK, "Ravi", 99999.99),
+]
+
+
+@pytest.mark.parametrize("opening_total", [0.0, 2500.50, -1234.56])
+def test_matches_legacy_loop(opening_total):
+    assert_same_ledger(statement(MIXED_ROWS), opening_total)
+
+
+def test_credit_opening_balance():
+    # Opening balance Credit में हो तो पहली row में Credit, Debit 0
+    ledger = build_ledger(BOOK, statement(MIXED_ROWS), -1234.56, START)
+    assert to_paise(ledger["Credit"].iloc[0]) == 123456
+    assert to_paise(ledger["Debit"].iloc[0]) == 0
+
+
+def test_self_transfer():
+    # from = to = book: loop इसे Debit गिनता था, vectorized version भी
+    df = statement([
+        (1, "2024-04-05", BOOK, BOOK, 300.00),
+        (2, "2024-04-05", BOOK, "Rent", 100.00),
+        (3, "2024-04-06", BOOK, BOOK, 0.01),
+    ])
+    assert_same_ledger(df, -50.00)
+    ledger = build_ledger(BOOK, df, -50.00, START)
+    assert ledger["Particular"].tolist()[1] == f"From {BOOK}"
+
+
+def test_same_day_rows_keep_id_order():
+    # एक ही दिन की कई entries: running balance id के क्रम में चलता है
+    df = statement([(i, "2024-04-10", *((BOOK, "Rent") if i % 3 else ("Sales", BOOK)), 10.10 * i) for i in range(1, 13)])
+    assert_same_ledger(df, 100.00)
+    ledger = build_ledger(BOOK, df, 100.00, START)
+    assert ledger["ID"].tolist()[1:] == list(range(1, 13))
+
+
+def test_empty_statement():
+    df = statement([])
+    assert_same_ledger(df, 777.77)
+    ledger = build_ledger(BOOK, df, 777.77, START)
+    assert len(ledger) == 1
+    assert to_paise(ledger["Balance"].iloc[0]) == 77777
+
+
+def test_long_book_balance_is_exact():
+    # हज़ारों छोटी रकम: paise cumsum बिल्कुल exact, float loop से पैसे में मेल खाता है
+    rows = [(i, "2024-05-01", *((BOOK, "Rent") if i % 2 else ("Sales", BOOK)), 0.10 + (i % 7) / 100) for i in range(1, 5001)]
+    assert_same_ledger(statement(rows), 0.30)
+
+
+def test_stale_version_raises_edit_conflict(ledger_db):
+    txn = add_transaction("2024-04-01", "Cash", "Bank", 100, "first")
+    seen = get_transaction(txn)["version"]
+
+    update_transaction(txn, "2024-04-01", "Cash", "Bank", 150, "edited", version=seen)
+    # दूसरा user अभी भी पुराना version लिए बैठा है
+    with pytest.raises(EditConflict) as conflict:
+        update_transaction(txn, "2024-04-01", "Cash", "Bank", 999, "lost update", version=seen)
+    assert (conflict.value.table, conflict.value.row_id) == ("transactions", txn)
+    with pytest.raises(EditConflict):
+        delete_transaction(txn, seen)
+
+    row = get_transaction(txn)
+    assert (row["note"], to_paise(row["amount"]), row["version"]) == ("edited", 15000, seen + 1)
+
+    delete_transaction(txn, seen + 1)
+    assert get_transaction(txn) is None
+    # पहले ही delete हो चुकी row पर भी conflict, चुपचाप कुछ नहीं
+    with pytest.raises(EditConflict):
+        update_transaction(txn, "2024-04-01", "Cash", "Bank", 1, "gone", version=seen + 1)
+
+
+def test_account_edit_conflict(ledger_db):
+    from db_pool import connection
+
+    with connection() as conn:
+        acc_id, version = conn.execute("SELECT id, version FROM accounts WHERE name = 'Bills'").fetchone()
+    update_account(acc_id, "Bills & Utilities", "", "", 1, version=version)
+    with pytest.raises(EditConflict):
+        update_account(acc_id, "Bills (old tab)", "", "", 1, version=version)
+    with connection() as conn:
+        assert conn.execute("SELECT name FROM accounts WHERE id = ?", (acc_id,)).fetchone() == ("Bills & Utilities",)
+
+
+def test_statement_helpers_do_not_leak_connections(ledger_db, monkeypatch):
+    # हर sqlite3.connect का हिसाब: Books tab के helpers pool से उधार लें, अपनी connection न खोलें
+    opened = []
+    real_connect = sqlite3.connect
+
+    class Tracked(sqlite3.Connection):
+        closed = False
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    def connect(*args, **kwargs):
+        conn = real_connect(*args, factory=Tracked, **kwargs)
+        opened.append(conn)
+        return conn
+
+    add_transaction("2024-04-02", "Sales Income", "Cash", 100, "sale")
+    db_pool.pool.close_all()
+    monkeypatch.setattr(sqlite3, "connect", connect)
+
+    for _ in range(25):
+        assert len(get_statement(BOOK, START, datetime.date(2024, 4, 30))) == 1
+        assert get_carried_forward(BOOK, datetime.date(2024, 5, 1)) == 100
+    # Query के बीच error हो तब भी connection pool में लौटे
+    for _ in range(5):
+        with pytest.raises(TypeError):
+            get_statement(BOOK, "not a date", START)
+        with pytest.raises(TypeError):
+            get_carried_forward(BOOK, None)
+
+    assert len(opened) == 1
+    db_pool.pool.close_all()
+    assert all(conn.closed for conn in opened)
@@ -0,0 +1,183 @@
+import sqlite3
+
+import setup_db
+from db_pool import connection
+from ledger_engine import (
+    add_transaction, update_transaction, delete_transaction, update_account,
+    search_transactions, find_similar_parties
+)
+from setup_db import migrate, rebuild_account_balances, SCHEMA_VERSION
+from write_queue import write
+
+# Triggers से भरी tables को सीधे transactions से दोबारा गिनकर मिलाते हैं
+BALANCES_SQL = """
+    SELECT account_id, SUM(amt_in), SUM(amt_out), COUNT(*) FROM (
+        SELECT to_id AS account_id, amount AS amt_in, 0 AS amt_out FROM transactions
+        UNION ALL
+        SELECT from_id, 0, amount FROM transactions
+    )
+    GROUP BY account_id
+"""
+DAILY_SQL = """
+    SELECT to_id, 'in', day, SUM(amount), COUNT(*) FROM transactions GROUP BY to_id, day
+    UNION ALL
+    SELECT from_id, 'out', day, SUM(amount), COUNT(*) FROM transactions GROUP BY from_id, day
+"""
+STORED_BALANCES_SQL = "SELECT account_id, total_in, total_out, txn_count FROM account_balances WHERE txn_count != 0"
+STORED_DAILY_SQL = "SELECT account_id, direction, day, total, txn_count FROM daily_totals"
+
+
+def rows(sql, db=None):
+    if db is None:
+        with connection() as conn:
+            return sorted(conn.execute(sql).fetchall())
+    conn = sqlite3.connect(db)
+    try:
+        return sorted(conn.execute(sql).fetchall())
+    finally:
+        conn.close()
+
+
+def busy_ledger():
+    """Inserts, edits of every money column, deletes, a self-transfer and a day that empties out"""
+    ids = [
+        add_transaction(f"2024-04-{1 + i % 5:02d}", *(("Cash", "Bank") if i % 2 else ("Sales Income", "Cash")),
+                        100 + i * 0.25, f"entry {i}")
+        for i in range(30)
+    ]
+    update_transaction(ids[0], "2024-04-09", "Bank", "Personal Expense", 55.50, "moved")
+    update_transaction(ids[1], "2024-04-02", "Cash", "Bank", 0.01, "amount only")
+    update_transaction(ids[4], "2024-04-05", "Cash", "Bank", 101.00, "note only")
+    delete_transaction(ids[2])
+    delete_transaction(ids[3])
+    add_transaction("2024-04-03", "Cash", "Cash", 12.00, "self transfer")
+    lonely = add_transaction("2024-05-01", "Bank", "Bills", 999.99, "only entry of the day")
+    delete_transaction(lonely)
+
+
+def test_balance_triggers_match_full_recompute(ledger_db):
+    busy_ledger()
+    assert rows(STORED_BALANCES_SQL) == rows(BALANCES_SQL)
+    assert rebuild_account_balances() == []
+
+
+def test_daily_totals_match_full_recompute(ledger_db):
+    busy_ledger()
+    assert rows(STORED_DAILY_SQL) == rows(DAILY_SQL)
+
+
+def test_rebuild_reports_drifted_account(ledger_db):
+    busy_ledger()
+    write(lambda conn: conn.execute(
+        "UPDATE account_balances SET total_in = total_in + 1 WHERE account_id = (SELECT id FROM accounts WHERE name = 'Bank')"
+    ))
+    assert rebuild_account_balances() == ["Bank"]
+    assert rows(STORED_BALANCES_SQL) == rows(BALANCES_SQL)
+
+
+def test_search_and_trigram_indexes_follow_writes(ledger_db):
+    party = write(lambda conn: conn.execute(
+        "INSERT INTO accounts (name, group_type) VALUES ('Ramesh Traders', 'Party')"
+    ).lastrowid)
+    txn = add_transaction("2024-04-01", "Cash", "Ramesh Traders", 10, "cement bags")
+    assert search_transactions("cement")[1] == 1
+
+    update_transaction(txn, "2024-04-01", "Cash", "Ramesh Traders", 10, "steel rods")
+    assert search_transactions("cement")[1] == 0
+    assert search_transactions("steel")[1] == 1
+
+    # Party rename: FTS में पुरानी rows का नाम और trigram index दोनों बदलें
+    update_account(party, "Suresh Traders", "", "", 1)
+    assert search_transactions("Suresh")[1] == 1
+    assert search_transactions("Ramesh")[1] == 0
+    assert [name for name, _ in find_similar_parties("Suresh Trader")] == ["Suresh Traders"]
+    assert find_similar_parties("Ramesh Traders", cutoff=0.9) == []
+
+    delete_transaction(txn)
+    assert search_transactions("steel")[1] == 0
+
+
+# init_db से पहले वाला schema (names और REAL rupees)
+LEGACY_SCHEMA = """
+    CREATE TABLE accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        phone TEXT,
+        group_type TEXT,
+        address TEXT,
+        is_active INTEGER DEFAULT 1
+    );
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT,
+        from_acc TEXT,
+        to_acc TEXT,
+        amount REAL,
+        note TEXT
+    );
+    CREATE TABLE opening_balances (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_name TEXT,
+        balance REAL,
+        type TEXT,
+        financial_year TEXT
+    );
+"""
+
+
+def legacy_database(path, n=40):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany("INSERT INTO accounts (name, is_active, group_type) VALUES (?, 1, 'Party')",
+                     [("Cash",), ("Bank",), ("Sales Income",)])
+    conn.executemany(
+        "INSERT INTO transactions (date, from_acc, to_acc, amount, note) VALUES (?, ?, ?, ?, ?)",
+        [(f"2024-04-{1 + i % 9:02d}", "Sales Income" if i % 3 else "Old Party", "Cash" if i % 2 else "Bank",
+          10.10 + i, f"[Payment] | Status: Completed | cement lot {i}" if i % 4 == 0 else f"plain note {i}")
+         for i in range(n)]
+    )
+    conn.execute("INSERT INTO opening_balances (account_name, balance, type, financial_year) "
+                 "VALUES ('Cash', 2500.55, 'Debit', '2024-25'), ('Gone Party', 10.0, 'Credit', '2024-25')")
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_legacy_database(tmp_path, monkeypatch):
+    # छोटे batches ताकि backfills कई id-ranges में चलें
+    monkeypatch.setattr(setup_db, "BACKFILL_BATCH", 7)
+    db = tmp_path / "legacy.db"
+    legacy_database(db)
+    progress = []
+
+    assert migrate(lambda *step: progress.append(step), db_file=db) == SCHEMA_VERSION
+    assert progress[-1][1:] == (SCHEMA_VERSION, SCHEMA_VERSION)
+    assert rows("PRAGMA user_version", db) == [(SCHEMA_VERSION,)]
+
+    migrated = rows("""
+        SELECT t.id, f.name, o.name, t.amount, t.txn_type, t.status, t.note, t.from_acc, t.to_acc, t.amount_rupees
+        FROM transactions t JOIN accounts f ON f.id = t.from_id JOIN accounts o ON o.id = t.to_id
+    """, db)
+    assert len(migrated) == 40
+    for txn_id, from_acc, to_acc, amount, txn_type, status, note, *old_columns in migrated:
+        i = txn_id - 1
+        assert (from_acc, to_acc) == ("Sales Income" if i % 3 else "Old Party", "Cash" if i % 2 else "Bank")
+        assert amount == 1010 + i * 100
+        if i % 4 == 0:
+            assert (txn_type, status, note) == ("Payment", "Completed", f"cement lot {i}")
+        else:
+            assert (txn_type, status, note) == (None, None, f"plain note {i}")
+        assert old_columns == [None, None, None]
+
+    assert rows("""
+        SELECT a.name, ob.balance, ob.type FROM opening_balances ob JOIN accounts a ON a.id = ob.account_id
+    """, db) == [("Cash", 250055, "Debit"), ("Gone Party", 1000, "Credit")]
+
+    # Derived tables पहली बार पूरे data से भरी गईं
+    assert rows(STORED_BALANCES_SQL, db) == rows(BALANCES_SQL, db)
+    assert rows(STORED_DAILY_SQL, db) == rows(DAILY_SQL, db)
+    assert len(rows("SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH 'cement'", db)) == 10
+
+    # दोबारा चलाना no-op है
+    before = rows("SELECT * FROM transactions", db)
+    assert migrate(db_file=db) == SCHEMA_VERSION
+    assert rows("SELECT * FROM transactions", db) == before
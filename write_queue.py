@@ -0,0 +1,164 @@
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from db_pool import connection
+
+# एक batch (= एक commit) में ज़्यादा से ज़्यादा इतनी writes - यही किसी write की latency की ऊपरी सीमा है
+MAX_BATCH = 64
+
+# busy_timeout (db_pool) के बाद भी lock न मिले तो इतनी बार, बढ़ते gap के साथ, दोबारा
+BUSY_RETRIES = 3
+RETRY_DELAY = 0.05
+
+WRITE_TIMEOUT = 60
+
+
+def _is_busy(error):
+    return isinstance(error, sqlite3.OperationalError) and getattr(
+        error, "sqlite_errorname", ""
+    ) in ("SQLITE_BUSY", "SQLITE_LOCKED", "SQLITE_BUSY_SNAPSHOT")
+
+
+class WriteQueue:
+    """
+    The single writer of this process: Streamlit sessions submit writes, one
+    background thread commits them.
+
+    A write is a function fn(conn, *args); its return value (or exception)
+    comes back through the Future from submit(). Writes that arrive together
+    are group-committed - whatever queued up while the previous commit ran,
+    up to MAX_BATCH, goes into one BEGIN IMMEDIATE ... COMMIT with no extra
+    waiting, so a lone write is not delayed - and each runs under its own
+    SAVEPOINT so a failing write is rolled back alone. A busy database is
+    retried; any other batch-level failure re-runs the writes one by one.
+
+    Writes must not submit further writes (the writer would wait on itself).
+    Code that has to write outside the queue (migrations, restore) holds
+    paused() meanwhile, so the writer never runs alongside it.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH):
+        self.max_batch = max_batch
+        self.stats = {"writes": 0, "batches": 0, "retries": 0}
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._pause_lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """Queue fn(conn, *args); returns a Future with its result"""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def write(self, fn, *args, timeout=WRITE_TIMEOUT):
+        """submit() and wait: returns fn's result or raises its exception"""
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # जो write अभी शुरू नहीं हुई उसे रद्द करो, ताकि caller को error मिलने के बाद वो चुपचाप न लग जाए
+            if future.cancel():
+                raise
+            return future.result()
+
+    @contextmanager
+    def paused(self):
+        """Hold the writer thread between batches for the duration of the block"""
+        with self._pause_lock:
+            yield
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            with self._pause_lock:
+                # जिनका caller cancel कर चुका (जैसे pause के दौरान timeout), उन्हें छोड़ दो
+                batch = [item for item in items if item[2].set_running_or_notify_cancel()]
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    # Writer thread कभी न रुके: इस batch को fail करो और अगले पर चलो
+                    print("⚠️ Writer: batch failed")
+                    traceback.print_exc()
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                outcomes = self._commit(batch)
+            except Exception as e:
+                error = e
+                if _is_busy(e) and attempt < BUSY_RETRIES:
+                    self.stats["retries"] += 1
+                    time.sleep(RETRY_DELAY * 2 ** attempt)
+                    continue
+                break
+            self.stats["batches"] += 1
+            self.stats["writes"] += len(batch)
+            for future, ok, value in outcomes:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            return
+
+        if len(batch) > 1 and not _is_busy(error):
+            # एक खराब write पूरे batch को न ले डूबे
+            for item in batch:
+                self._flush([item])
+        else:
+            for _, _, future in batch:
+                future.set_exception(error)
+
+    def _commit(self, batch):
+        """Run the whole batch in one transaction; returns [(future, ok, result or exception)]"""
+        outcomes = []
+        with connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((future, True, fn(conn, *args)))
+                except Exception as e:
+                    if _is_busy(e):
+                        raise
+                    conn.execute("ROLLBACK TO write")
+                    outcomes.append((future, False, e))
+                conn.execute("RELEASE write")
+            conn.commit()
+        return outcomes
+
+
+writer = WriteQueue()
+
+
+def write(fn, *args, timeout=WRITE_TIMEOUT):
+    """Shortcut for writer.write(): run fn(conn, *args) on the writer thread and return its result"""
+    return writer.write(fn, *args, timeout=timeout)